@@ -0,0 +1,314 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Frame-time benchmark of the twister simulation, one stage at a time.
+# A synthetic scene of n_tornadoes funnels sharing n_particles particles is
+# built headless, and every stage of a frame is timed on its own:
+#   advect     particle advection of every tornado (Vortex.update_particles)
+#   debris     debris motion (Vortex.update_debris)
+#   atmosphere AtmosphericModel.update
+#   ai         pursuit moves (Simulation.ai_step) and one pressure descent
+#              without a target, descent targets recomputed as after a step
+#   collision  broad phase + fusion queue (overlapping_pairs, fusion_queue)
+#   fusion     Simulation.fuse_colliding on a scene of touching pairs
+#              (fuse_instant, particles concatenated)
+#   interaction tree-code wind induced by the tornadoes at their centers
+#   minimap    wind on the mini-map grid, arrow angles and colors
+#   weather    Rain.update
+#   windgrid   one step of a 256x256 TwisterFluid.WindGrid forced by the tornadoes
+#   render     particle_style + PointCloud upload (needs Panda3D, no window)
+#   visible    same through SceneView and a TwisterCulling.ParticleLOD, seen
+#              by a camera at the edge of the terrain looking at its center
+# Every timed sample starts from the same scene (SceneSnapshot), whatever the
+# stages timed before it moved or consumed.
+# Results are written as JSON; 'compare' prints the ratio of every stage
+# against a saved baseline:
+#
+#   python TwisterBench.py run --out baseline.json
+#   python TwisterBench.py run --out new.json --particles 1000,100000 --tornadoes 1,16
+#   python TwisterBench.py compare baseline.json new.json
+
+import argparse
+import json
+import platform
+import time
+
+import numpy as np
+from TwisterCulling import Frustum, ParticleLOD
+from TwisterEngine import (
+    AtmosphericModel, Rain, Simulation, Terrain, Vortex, fusion_queue, overlapping_pairs,
+)
+from TwisterFluid import WindGrid
+
+STAGES = ['advect', 'debris', 'atmosphere', 'ai', 'collision', 'fusion', 'interaction', 'minimap', 'weather', 'windgrid',
+          'render', 'visible']
+
+
+# ----------- Scene -----------
+def bench_scene(n_particles, n_tornadoes, seed=0, touching=False):
+    """
+    n_tornadoes funnels on a square grid of a terrain large enough to hold
+    them, with n_particles particles split evenly, 100 debris each, an
+    atmosphere already perturbed by the funnels and the rain of the AI
+    scenario. Every other tornado is AI controlled. touching=True puts
+    tornado 2k+1 one unit away from tornado 2k, so that every pair fuses.
+    """
+    rng = np.random.default_rng(seed)
+    cells = (n_tornadoes + 1) // 2 if touching else n_tornadoes
+    side = int(np.ceil(np.sqrt(cells)))
+    terrain = Terrain(size=max(64, 16*side))
+    spacing = terrain.extent / side
+    tornadoes = []
+    for k in range(n_tornadoes):
+        i, j = divmod(k // 2 if touching else k, side)
+        offset = 1.0 if touching and k % 2 else 0.0
+        tornadoes.append(Vortex(position=((i + 0.5)*spacing + offset, 0, (j + 0.5)*spacing),
+                                n_particles=max(n_particles // n_tornadoes, 1),
+                                n_debris=100, ai_controlled=k % 2 == 1, rng=rng))
+    atmo = AtmosphericModel(terrain.size, terrain.scale, incremental=True)
+    atmo.update(tornadoes)
+    rain = Rain(terrain.extent, capacity=1000, rng=rng)
+    return Simulation(terrain, tornadoes, atmosphere=atmo, fusion='instant', rain=rain)
+
+
+class SceneSnapshot:
+    """
+    Copy of everything a stage can change in a bench scene: the simulation
+    state, the atmosphere, the rain and every tornado with its particles and
+    debris (arrays, containers, scalars and random streams). restore() puts
+    it back in place, the arrays keep their identity, so that every timed
+    sample of every stage starts from the same scene.
+    """
+
+    def __init__(self, sim):
+        objects = [sim.state, sim.atmosphere, sim.rain]
+        for t in sim.tornadoes:
+            objects += [t, t.particles, t.debris]
+        self.saved = [(obj, {name: self.copy(value) for name, value in vars(obj).items()})
+                      for obj in objects if obj is not None]
+
+    @staticmethod
+    def copy(value):
+        if isinstance(value, np.ndarray):
+            return value, value.copy()
+        if isinstance(value, np.random.Generator):
+            return value, value.bit_generator.state
+        if isinstance(value, (list, dict)):
+            return value, value.copy()
+        return value, None
+
+    def restore(self):
+        for obj, attributes in self.saved:
+            for name, (value, saved) in attributes.items():
+                if isinstance(value, np.ndarray):
+                    value[...] = saved
+                elif isinstance(value, np.random.Generator):
+                    value.bit_generator.state = saved
+                elif isinstance(value, list):
+                    value[:] = saved
+                elif isinstance(value, dict):
+                    value.clear()
+                    value.update(saved)
+                setattr(obj, name, value)
+
+
+# ----------- Stages -----------
+def stage_functions(sim, dt):
+    ts = sim.tornadoes
+    e = sim.terrain.extent
+    grid = np.arange(2, e-2, max(2.0, e/32))
+    gx, gz = np.meshgrid(grid, grid, indexing='ij')
+    gx, gz = gx.ravel(), gz.ravel()
+    thresholds = (0.5, 1.0)
+
+    def advect():
+        for t in ts:
+            t.update_particles(dt, sim.state.time, sim.terrain, sim.atmosphere)
+
+    def debris():
+        for t in ts:
+            t.update_debris(dt, sim.terrain, sim.state.time)
+
+    shift = [sim.terrain.scale]
+
+    def atmosphere():
+        # Every tornado moves by one cell: the incremental update redoes all the stencils
+        shift[0] = -shift[0]
+        for t in ts:
+            t.position[0] += shift[0]
+        sim.atmosphere.update(ts)
+
+    def collision():
+        points = np.array([t.position[[0, 2]] for t in ts])
+        fusion_queue(overlapping_pairs(points, [t.collider_radius for t in ts]))
+
+    def minimap():
+        wind = sim.wind_at(gx, gz)
+        norm = np.hypot(wind[:, 0], wind[:, 1])
+        np.where(norm < 1e-3, 0.0, np.degrees(np.arctan2(wind[:, 0], wind[:, 1])))
+        np.searchsorted(thresholds, norm, side='right')
+
+    def weather():
+        sim.rain.update(dt, ts, sim.terrain)
+
+    def ai():
+        # As after the atmosphere update of a step: the descent targets are recomputed
+        sim.atmosphere.target_cells = None
+        sim.ai_step(dt)
+        # With several tornadoes ai_step only chases the player, the pressure
+        # descent (no target) is timed on the last tornado
+        ts[-1].ai_move(sim.atmosphere, dt)
+
+    wind_grid = WindGrid(256, e / 256)
+
+    stages = {
+        'advect': advect,
+        'debris': debris,
+        'atmosphere': atmosphere,
+        'ai': ai,
+        'collision': collision,
+        'interaction': lambda: sim.mutual_advection(0.0),
+        'minimap': minimap,
+        'weather': weather,
+        'windgrid': lambda: wind_grid.step(dt, ts),
+    }
+    try:
+        from panda3d.core import NodePath
+        from TwisterRender import PointCloud, SceneView, particle_style
+    except ImportError:
+        return stages
+    root = NodePath('bench')
+    clouds = [PointCloud(t.n_particles, parent=root, use_shader=False) for t in ts]
+
+    def render():
+        for t, cloud in zip(ts, clouds):
+            cols, sizes = particle_style(t)
+            cloud.update(t.particles.pos, cols, sizes)
+
+    lod = ParticleLOD()
+    view = SceneView(parent=root)
+    frustum = Frustum((e/2, 10, -30), (0, -0.2, 1), fov=(40.0, 23.1))
+
+    def visible():
+        lod.update(frustum, ts)
+        view.sync(ts, lod=lod)
+
+    stages['render'] = render
+    stages['visible'] = visible
+    return stages
+
+
+def time_stage(fn, repeat, min_time=0.05, reset=None):
+    """
+    Median and minimum time (ms) of one call, over repeat samples of at
+    least min_time seconds each (small stages are called in a loop). reset,
+    when given, is called (untimed) before every sample.
+    """
+    reset = reset or (lambda: None)
+    reset()
+    fn()
+    reset()
+    start = time.perf_counter()
+    fn()
+    once = time.perf_counter() - start
+    loops = max(1, int(min_time / max(once, 1e-9)))
+    samples = []
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops * 1e3)
+    return float(np.median(samples)), float(np.min(samples))
+
+
+def run(particles, tornadoes, repeat=5, dt=1/60, stages=None):
+    results = []
+    for n in particles:
+        for n_t in tornadoes:
+            sim = bench_scene(n, n_t)
+            fns = stage_functions(sim, dt)
+            snapshot = SceneSnapshot(sim)
+            snapshots = {}
+            if 'fusion' in (stages or STAGES):
+                fusing = bench_scene(n, n_t, touching=True)
+                fns['fusion'] = fusing.fuse_colliding
+                snapshots['fusion'] = SceneSnapshot(fusing)
+            for name in stages or STAGES:
+                if name not in fns:
+                    continue
+                reset = snapshots.get(name, snapshot).restore
+                median, best = time_stage(fns[name], repeat, reset=reset)
+                reset()
+                results.append({'particles': n, 'tornadoes': n_t, 'stage': name,
+                                'median_ms': median, 'min_ms': best})
+                print('%8d particles %4d tornadoes  %-10s %10.3f ms' % (n, n_t, name, median))
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Ratio current/baseline of the median time of every (particles,
+    tornadoes, stage) present in both files; changes beyond threshold are
+    flagged. Returns the number of regressions.
+    """
+    key = lambda r: (r['particles'], r['tornadoes'], r['stage'])
+    base = {key(r): r['median_ms'] for r in baseline['results']}
+    regressions = 0
+    for r in current['results']:
+        if key(r) not in base:
+            continue
+        ratio = r['median_ms'] / max(base[key(r)], 1e-9)
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'SLOWER'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print('%8d particles %4d tornadoes  %-10s %10.3f -> %10.3f ms  x%.2f %s'
+              % (key(r) + (base[key(r)], r['median_ms'], ratio, flag)))
+    return regressions
+
+
+def int_list(text):
+    return [int(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage frame-time benchmark of the twister simulation.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run')
+    p_run.add_argument('--out', default='bench.json')
+    p_run.add_argument('--particles', type=int_list, default=[1000, 10000, 100000, 1000000])
+    p_run.add_argument('--tornadoes', type=int_list, default=[1, 4, 16, 64, 256])
+    p_run.add_argument('--stages', type=lambda s: s.split(','), default=None)
+    p_run.add_argument('--repeat', type=int, default=5)
+    p_cmp = sub.add_parser('compare')
+    p_cmp.add_argument('baseline')
+    p_cmp.add_argument('current')
+    p_cmp.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run(args.particles, args.tornadoes, args.repeat, stages=args.stages)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        if compare(baseline, current, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Visibility stage of the front-ends: what the camera sees decides what is
+# drawn and how often the particles are integrated, so the frame cost follows
+# the screen instead of the total particle count.
+#   - culling: every funnel is cut in altitude bands, each bounded by a
+#     sphere (tilt, oscillation and radius of the funnel included) and tested
+#     against the camera frustum; a tornado with no visible band is not drawn
+#     at all (particles and debris), a partly visible one only uploads the
+#     particles of its visible bands
+#   - level of detail: past lod_distance, every sqrt(2) farther halves the
+#     particles drawn (a fixed random subset, so the density stays uniform
+#     along the funnel and across the palette blocks) and enlarges them by
+#     sqrt(2), which keeps the covered screen area, i.e. the apparent density
+#     of the funnel
+#   - physics: far funnels integrate their particles and debris every
+#     2**level steps (with the summed dt), culled ones either every
+#     culled_interval steps ('rate') or not at all until they come back into
+#     view, when they catch up on at most TwisterEngine.MAX_CATCHUP seconds
+#     ('catchup'). The funnel flow is statistically steady, so the catch-up
+#     looks like the funnel never stopped. Tornado motion, fusion and wind
+#     are never skipped; only the particles and debris (pure visuals) then
+#     depend on the camera.
+#
+# Pure NumPy: the frustum is read from the Ursina camera (Frustum.from_camera)
+# or given explicitly, so the stage also runs headless.
+
+import numpy as np
+
+
+# ----------- Frustum -----------
+class Frustum:
+    """
+    Perspective view volume.
+    position, forward, up: camera frame in world coordinates
+    fov                  : (horizontal, vertical) field of view in degrees
+    near, far            : clip distances
+    """
+
+    def __init__(self, position, forward, up=(0, 1, 0), fov=(90.0, 60.0), near=0.1, far=10000.0):
+        self.position = np.asarray(position, dtype=float)
+        f = np.asarray(forward, dtype=float)
+        self.forward = f / np.linalg.norm(f)
+        right = np.cross(np.asarray(up, dtype=float), self.forward)
+        self.right = right / np.linalg.norm(right)
+        self.up = np.cross(self.forward, self.right)
+        self.tan_h, self.tan_v = np.tan(np.radians(np.asarray(fov, dtype=float)) / 2)
+        self.near = near
+        self.far = far
+
+    @classmethod
+    def from_camera(cls, camera):
+        """
+        Frustum of the Ursina camera (lens of the perspective camera).
+        """
+        lens = camera.lens
+        fov = lens.get_fov()
+        return cls(tuple(camera.world_position), tuple(camera.forward), tuple(camera.up),
+                   (fov[0], fov[1]), lens.get_near(), lens.get_far())
+
+    def sphere_visibility(self, centers, radii):
+        """
+        Spheres (..., 3) of radii (...) that intersect the view volume, and
+        the distance from the camera to their nearest point (0 inside).
+        """
+        v = np.asarray(centers, dtype=float) - self.position
+        radii = np.asarray(radii, dtype=float)
+        depth = v @ self.forward
+        x = np.abs(v @ self.right)
+        y = np.abs(v @ self.up)
+        # Distance to the side planes, the sphere may straddle them
+        visible = (depth > self.near - radii) & (depth < self.far + radii)
+        visible &= x - depth * self.tan_h <= radii * np.sqrt(1 + self.tan_h**2)
+        visible &= y - depth * self.tan_v <= radii * np.sqrt(1 + self.tan_v**2)
+        distance = np.maximum(np.linalg.norm(v, axis=-1) - radii, 0.0)
+        return visible, distance
+
+
+# ----------- Particle LOD -----------
+class ParticleLOD:
+    """
+    lod_distance   : distance up to which every particle is drawn
+    max_level      : largest number of halvings (1/16 of the particles by default)
+    bands          : altitude bands per funnel tested against the frustum
+    margin         : added to the band radii (jitter, wind offset of the columns)
+    physics        : 'full' (integrate everything every step), 'rate' or
+                     'catchup' (see the header)
+    culled_interval: steps between two integrations of a culled funnel ('rate')
+    """
+
+    def __init__(self, lod_distance=40.0, max_level=4, bands=8, margin=1.0, physics='catchup', culled_interval=8,
+                 seed=0):
+        if physics not in ('full', 'rate', 'catchup'):
+            raise ValueError('unknown physics mode %r' % physics)
+        self.lod_distance = lod_distance
+        self.max_level = max_level
+        self.bands = bands
+        self.margin = margin
+        self.physics = physics
+        self.culled_interval = culled_interval
+        self.rng = np.random.default_rng(seed)
+        self.plans = {}
+        self.subsets = {}
+
+    def update(self, frustum, tornadoes):
+        """
+        Plans the frame: for every tornado, None when it is culled, otherwise
+        (level, visible bands). Also sets the particle_interval of the tornadoes.
+        """
+        self.plans = {}
+        if not tornadoes:
+            self.subsets = {}
+            return self.plans
+        live = {id(t) for t in tornadoes}
+        self.subsets = {key: s for key, s in self.subsets.items() if key in live}
+        visible, distance = frustum.sphere_visibility(*self.band_spheres(tornadoes))
+        nearest = np.where(visible, distance, np.inf).min(axis=1)
+        ratio = np.clip(nearest / self.lod_distance, 1e-9, 1e9)
+        levels = np.clip(np.floor(2 * np.log2(ratio)), 0, self.max_level).astype(int)
+        for t, bands, level in zip(tornadoes, visible, levels):
+            shown = bands.any()
+            self.plans[id(t)] = (int(level), None if bands.all() else bands) if shown else None
+            if self.physics == 'full':
+                t.particle_interval = 1
+            elif shown:
+                t.particle_interval = 1 << int(level)
+            else:
+                t.particle_interval = self.culled_interval if self.physics == 'rate' else 0
+        return self.plans
+
+    def band_spheres(self, tornadoes):
+        # Bounding spheres (tornadoes, bands) of the funnel slices: the axis
+        # leans by max_inclination * frac and oscillates by sin_amplitude, the
+        # radius grows at most linearly from radius_base to radius_top
+        g = np.array([(t.x, t.z, t.base_y, t.height, t.radius_base, t.radius_top, t.max_inclination,
+                       t.sin_amplitude) for t in tornadoes], dtype=float)
+        x, z, base, height, r0, r1, lean, swing = (c[:, None] for c in g.T)
+        lo = np.arange(self.bands) / self.bands
+        mid = lo + 0.5 / self.bands
+        hi = lo + 1.0 / self.bands
+        centers = np.stack(np.broadcast_arrays(x + lean*mid, base + height*mid, z), axis=-1)
+        reach = np.abs(lean) / (2*self.bands) + np.abs(swing) + r0 + (r1 - r0)*hi
+        radii = np.hypot(height / (2*self.bands), reach) + self.margin
+        return centers, radii
+
+    def plan(self, t):
+        # Tornadoes born after update (fusion) are drawn in full
+        return self.plans.get(id(t), (0, None))
+
+    def index(self, t, level, bands):
+        """
+        Indices of the particles of t to draw at this level, restricted to
+        the visible bands (None: all of them).
+        """
+        n = t.n_particles
+        if level == 0:
+            if bands is None:
+                return None
+            index, z = None, t.particles.z
+        else:
+            subsets = self.subsets.get(id(t))
+            if subsets is None or subsets[0] != n:
+                subsets = self.subsets[id(t)] = (n, self.rng.permutation(n), {})
+            _, order, levels = subsets
+            index = levels.get(level)
+            if index is None:
+                # Sorted: the gathers then read the particle arrays in order
+                index = levels[level] = np.sort(order[:max(n >> level, 1)])
+            if bands is None:
+                return index
+            z = t.particles.z[index]
+        shown = np.flatnonzero(bands)
+        if shown[-1] - shown[0] + 1 == len(shown):
+            # One run of bands (the usual case): an altitude range
+            step = t.height / self.bands
+            lo = shown[0] * step if shown[0] > 0 else -np.inf
+            hi = (shown[-1] + 1) * step if shown[-1] < self.bands - 1 else np.inf
+            keep = (z >= lo) & (z < hi)
+        else:
+            band = np.clip((z * (self.bands / t.height)).astype(np.intp), 0, self.bands - 1)
+            keep = bands[band]
+        return np.flatnonzero(keep) if index is None else index[keep]
+
+    @staticmethod
+    def size_scale(level):
+        return 2.0 ** (level / 2)
@@ -0,0 +1,214 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Structure-of-arrays debris engine: pieces picked up, lofted and thrown by a
+# tornado, all of them advanced with a handful of array operations per step.
+# Every piece carries a position, a velocity and a class (DEBRIS_CLASSES)
+# that sets its drag and how it is drawn. The air around the tornado is its
+# vortex profile (TwisterVortex) about the funnel axis at the altitude of
+# the piece (tilt and oscillation of the funnel included):
+#   - tangential wind of the profile, halved near the ground
+#   - radial wind of the profile plus the boundary-layer inflow near the
+#     ground (inflow * tangential wind), which carries the debris to the core
+#     against the centrifugal force
+#   - vertical wind of the profile plus the updraft of the funnel, strongest
+#     on the axis and vanishing at 4/3 of the funnel radius and above its top
+# With a TwisterFluid.WindGrid, the horizontal wind is sampled from the grid
+# instead (it carries the forcing of every tornado, advected and made
+# divergence free), and the vertical wind stays that of the profile.
+# Each step integrates, for every piece,
+#   dv/dt = drag * |u - v| (u - v) + gravity
+# with the quadratic drag taken implicitly (stable for any dt and drag), then
+# collides the pieces with the terrain (one batched height lookup for all of
+# them): they stop sinking, bounce a little and slide with Coulomb friction,
+# so a piece only moves on the ground once the wind beats it. Light
+# classes (terminal speed sqrt(gravity/drag) below the updraft) are lofted
+# up the funnel and thrown out of its top, heavy ones only roll on the
+# ground. Pieces that stray farther than recycle_radius from the tornado (or
+# too high) are put back on the ground around its base, so the number of
+# pieces, and the cost of a step, stay constant:
+#
+#   python TwisterDebris.py --pieces 20000 --steps 300
+
+import argparse
+import time
+
+import numpy as np
+from TwisterVortex import RANKINE
+
+GRAVITY = 9.81
+
+# name, drag (1/unit: drag force / mass / speed**2), drawn size, RGBA
+DEBRIS_CLASSES = (
+    ('dust', 3.0, 0.05, (0.45, 0.36, 0.25, 0.6)),
+    ('leaves', 1.0, 0.08, (0.25, 0.35, 0.1, 0.8)),
+    ('planks', 0.25, 0.14, (0.35, 0.22, 0.1, 0.9)),
+    ('rocks', 0.04, 0.12, (0.0, 0.0, 0.0, 0.7)),
+)
+
+
+# ----------- Debris Field -----------
+class DebrisField:
+    """
+    Debris of one tornado stored as parallel arrays.
+
+    pos, vel   : world positions and velocities (n, 3)
+    kind       : class index into DEBRIS_CLASSES
+    ring       : (inner, outer) radii of the ground ring where pieces (re)spawn
+    inflow     : ground inflow as a fraction of the tangential wind
+    updraft    : vertical wind on the funnel axis (units/s)
+    restitution: fraction of the vertical speed kept when bouncing
+    friction   : Coulomb friction coefficient of the ground (sliding pieces
+                 slow down by friction * gravity)
+    recycle_radius: distance from the tornado past which a piece respawns
+    """
+
+    def __init__(self, n, ring, mix=(0.4, 0.3, 0.2, 0.1), inflow=0.8, updraft=4.0, restitution=0.3, friction=0.5,
+                 recycle_radius=30.0, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.ring = ring
+        self.inflow = inflow
+        self.updraft = updraft
+        self.restitution = restitution
+        self.friction = friction
+        self.recycle_radius = recycle_radius
+        self.pos = np.zeros((n, 3))
+        self.vel = np.zeros((n, 3))
+        self.kind = self.rng.choice(len(DEBRIS_CLASSES), n, p=np.asarray(mix) / np.sum(mix)).astype(np.int8)
+        self.drag = np.array([c[1] for c in DEBRIS_CLASSES])[self.kind]
+        # Placed on the ring by the first step, when the base is known
+        self.spawned = False
+        self._style = None
+
+    def __len__(self):
+        return len(self.pos)
+
+    def respawn(self, index, origin, terrain):
+        # Pieces of index back on the ground ring around origin, at rest
+        n = len(index)
+        inner, outer = self.ring
+        a = self.rng.uniform(0, 2*np.pi, n)
+        r = np.sqrt(self.rng.uniform(inner**2, outer**2, n))
+        self.pos[index, 0] = origin[0] + r * np.cos(a)
+        self.pos[index, 2] = origin[2] + r * np.sin(a)
+        self.pos[index, 1] = terrain.heights(self.pos[index, 0], self.pos[index, 2])
+        self.vel[index] = 0.0
+
+    # ----------- Air -----------
+    def air(self, vortex, clock, origin, wind_grid=None):
+        """
+        Wind (n, 3) of the vortex at the pieces, horizontal part from
+        wind_grid when given.
+        """
+        p = self.pos
+        height = vortex.height
+        frac = np.clip((p[:, 1] - origin[1]) / height, 0, 1)
+        phase = vortex.sin_freq * frac * np.pi
+        dx = p[:, 0] - (origin[0] + vortex.max_inclination * frac + vortex.sin_amplitude * np.sin(phase + clock))
+        dz = p[:, 2] - (origin[2] + vortex.sin_amplitude * np.cos(phase + clock * 0.8))
+        r = np.hypot(dx, dz)
+        r_safe = np.maximum(r, 1e-3)
+        profile = getattr(vortex, 'profile', RANKINE)
+        strain = getattr(vortex, 'strain', 0.0)
+        rc = vortex.core_radius
+        altitude = np.maximum(p[:, 1] - origin[1], 0)
+        # Surface layer (first core radius of altitude): ground friction halves
+        # the swirl and turns it into inflow
+        layer = np.exp(-altitude / rc)
+        u_t = profile.tangential(r, rc, vortex.omega0)
+        u_r = profile.radial(r, rc, strain) - self.inflow * u_t * layer
+        u_t *= 1 - 0.5 * layer
+        # Updraft: 1 on the axis, 0 at 4/3 of the funnel radius (or of the core, if wider)
+        reach = np.maximum(vortex.radius_base + (vortex.radius_top - vortex.radius_base) * frac**1.5, rc)
+        u_z = self.updraft * np.clip(1 - 0.75 * r / reach, 0, None) * (p[:, 1] - origin[1] < height)
+        u_z += profile.vertical(r, altitude, rc, strain)
+        u = np.empty_like(p)
+        u[:, 0] = (dx * u_r - dz * u_t) / r_safe + vortex.wind_speed[0]
+        u[:, 1] = u_z
+        u[:, 2] = (dz * u_r + dx * u_t) / r_safe + vortex.wind_speed[2]
+        if wind_grid is not None:
+            u[:, 0::2] = wind_grid.sample(p[:, 0], p[:, 2])
+        return u
+
+    # ----------- Step -----------
+    def step(self, dt, clock, vortex, origin, terrain, wind_grid=None):
+        """
+        Advances every piece by dt around the vortex whose base is at origin,
+        and collides them with terrain (anything with heights(x, z)).
+        wind_grid: TwisterFluid.WindGrid giving the horizontal wind, or None.
+        """
+        if not len(self):
+            return self.pos
+        if not self.spawned:
+            self.respawn(np.arange(len(self)), origin, terrain)
+            self.spawned = True
+        # Far or too high pieces start again on the ground around the base
+        off = np.hypot(self.pos[:, 0] - origin[0], self.pos[:, 2] - origin[2]) > self.recycle_radius
+        off |= self.pos[:, 1] > origin[1] + 2 * vortex.height
+        if off.any():
+            self.respawn(np.flatnonzero(off), origin, terrain)
+
+        # v <- (v + dt (c u + g)) / (1 + dt c), c = drag |u - v|
+        u = self.air(vortex, clock, origin, wind_grid)
+        c = np.linalg.norm(u - self.vel, axis=1)
+        c *= self.drag * dt
+        self.vel += c[:, None] * u
+        self.vel[:, 1] -= dt * GRAVITY
+        self.vel /= (1 + c)[:, None]
+        self.pos += dt * self.vel
+
+        # Terrain: no sinking, a small bounce and sliding friction
+        ground = terrain.heights(self.pos[:, 0], self.pos[:, 2])
+        hit = self.pos[:, 1] < ground
+        if hit.any():
+            self.pos[hit, 1] = ground[hit]
+            v = self.vel[hit]
+            v[:, 1] = np.maximum(-self.restitution * v[:, 1], 0)
+            slide = np.hypot(v[:, 0], v[:, 2])
+            v[:, [0, 2]] *= (np.maximum(slide - self.friction * GRAVITY * dt, 0) / np.maximum(slide, 1e-12))[:, None]
+            self.vel[hit] = v
+        return self.pos
+
+    def style(self):
+        """
+        Colors (n, 4) and sizes (n,) of the pieces, by class (computed once).
+        """
+        if self._style is None:
+            self._style = (np.array([c[3] for c in DEBRIS_CLASSES])[self.kind],
+                           np.array([c[2] for c in DEBRIS_CLASSES])[self.kind])
+        return self._style
+
+
+def main():
+    from TwisterEngine import SCENARIOS
+    parser = argparse.ArgumentParser(description='Time the debris engine on a headless scenario.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='one')
+    parser.add_argument('--pieces', type=int, default=20000, help='debris pieces per tornado')
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--dt', type=float, default=1/60)
+    args = parser.parse_args()
+
+    sim = SCENARIOS[args.scenario](0)
+    for t in sim.tornadoes:
+        if t.n_debris:
+            t.debris = DebrisField(args.pieces, t.debris.ring, recycle_radius=t.debris.recycle_radius,
+                                   rng=t.debris.rng)
+            t.n_debris = args.pieces
+    for _ in range(args.steps):
+        sim.step(args.dt)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        for t in sim.tornadoes:
+            t.update_debris(args.dt, sim.terrain, sim.state.time)
+    elapsed = time.perf_counter() - start
+    for t in sim.tornadoes:
+        if t.n_debris:
+            d = t.debris
+            altitude = d.pos[:, 1] - sim.terrain.heights(d.pos[:, 0], d.pos[:, 2])
+            aloft = ', '.join('%s %.0f%%' % (c[0], 100 * np.mean(altitude[d.kind == k] > 0.5))
+                              for k, c in enumerate(DEBRIS_CLASSES) if np.any(d.kind == k))
+            print('%d pieces: %.2f ms per step, airborne (0.5 unit above the ground): %s'
+                  % (len(d), elapsed / args.steps * 1e3 / len(sim.tornadoes), aloft))
+
+
+if __name__ == '__main__':
+    main()
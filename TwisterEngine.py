@@ -0,0 +1,1387 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Headless simulation core of the twister scripts.
+# Terrain sampling, vortex kinematics, the atmospheric model, the fusion logic
+# and the AI movement live here, without any Ursina import. A Simulation holds
+# a SimulationState and is advanced explicitly with step(dt); the Ursina
+# scripts only build a scenario, call step(time.dt) in update() and draw the
+# state (see TwisterRender.SceneView). Without a window the same scenarios run
+# much faster than real time:
+#
+#   python TwisterEngine.py --scenario fusion --steps 20000 --dt 0.02
+#
+# Runs are deterministic: every random subsystem draws from its own stream of
+# an RngPlan built from one seed, and motion only depends on the simulation
+# clock (the sum of the dt passed to step), never on wall time. A ReplayLog
+# keeps the seed, the dt sequence and the player inputs of a run, enough to
+# reproduce it exactly:
+#
+#   python TwisterEngine.py --replay last_run.npz
+
+import argparse
+import time
+import zlib
+
+import numpy as np
+from TwisterDebris import DebrisField
+from TwisterParticles import ParticleStore
+from TwisterProfile import NULL_PROFILER
+from TwisterTree import VortexTree
+from TwisterVortex import RANKINE, get_profile, taper
+
+# Ursina colors as plain RGBA tuples (the engine does not import Ursina)
+AZURE = (0.0, 0.5, 1.0, 1.0)
+CYAN = (0.0, 1.0, 1.0, 1.0)
+BLUE = (0.0, 0.0, 1.0, 1.0)
+ORANGE = (1.0, 0.5, 0.0, 1.0)
+RED = (1.0, 0.0, 0.0, 1.0)
+WHITE = (1.0, 1.0, 1.0, 1.0)
+
+
+# ----------- Random Streams -----------
+class RngPlan:
+    """
+    One independent NumPy Generator per named subsystem ('tornado1', 'rain',
+    ...), all derived from a single seed. A stream only depends on the seed
+    and its name, so adding a subsystem never shifts the draws of the others.
+    seed=None draws a fresh seed, kept in self.seed to replay the run.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.streams = {}
+
+    def __call__(self, name):
+        if name not in self.streams:
+            seq = np.random.SeedSequence(self.seed, spawn_key=(zlib.crc32(name.encode()),))
+            self.streams[name] = np.random.default_rng(seq)
+        return self.streams[name]
+
+
+def _rng_state(rng):
+    # Snapshot of a Generator (None stays None), see _rng_restore
+    return None if rng is None else (type(rng.bit_generator), rng.bit_generator.state)
+
+
+def _rng_restore(snapshot):
+    if snapshot is None:
+        return None
+    kind, state = snapshot
+    bit_generator = kind()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+# ----------- Terrain (heightmap) -----------
+class Terrain:
+    def __init__(self, size=64, scale=0.7, height_scale=0.8):
+        self.size = size
+        self.scale = scale
+        self.height_scale = height_scale
+        # Sinusoidal heightmap: vertex (i, j) sits at (i*scale, heightmap[i, j], j*scale)
+        x = np.linspace(0, 4*np.pi, size)
+        y = np.linspace(0, 4*np.pi, size)
+        xx, yy = np.meshgrid(x, y)
+        self.heightmap = (np.sin(xx) * np.cos(yy)) * height_scale
+
+    @property
+    def extent(self):
+        return self.size * self.scale
+
+    def heights(self, x, z, normals=False):
+        """
+        Bilinear heights at arrays of world coordinates, following the mesh
+        (row i of the heightmap is at x = i*scale, column j at z = j*scale).
+        Points outside the terrain take the height of the nearest edge. With
+        normals=True, also returns the unit surface normals, shape + (3,).
+        """
+        fx = np.clip(np.asarray(x, dtype=float)/self.scale, 0, self.size-1)
+        fz = np.clip(np.asarray(z, dtype=float)/self.scale, 0, self.size-1)
+        i = np.minimum(fx.astype(int), self.size-2)
+        j = np.minimum(fz.astype(int), self.size-2)
+        tx = fx - i
+        tz = fz - j
+        h = self.heightmap
+        h00, h01, h10, h11 = h[i, j], h[i, j+1], h[i+1, j], h[i+1, j+1]
+        top = h00 + (h01 - h00)*tz
+        bottom = h10 + (h11 - h10)*tz
+        y = top + (bottom - top)*tx
+        if not normals:
+            return y
+        dx = (bottom - top) / self.scale
+        dz = (h01 - h00 + (h11 - h10 - h01 + h00)*tx) / self.scale
+        return y, surface_normals(dx, dz)
+
+    def get_height(self, x, z):
+        return float(self.heights(x, z))
+
+    def clamp(self, position, margin=2):
+        position[0] = np.clip(position[0], margin, self.extent - margin)
+        position[2] = np.clip(position[2], margin, self.extent - margin)
+
+    def mesh_arrays(self):
+        """
+        Vertices (n, 3), triangle indices (flat) and uvs (n, 2) of the terrain
+        mesh; each quad is split into two triangles.
+        """
+        size = self.size
+        i, j = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+        i = i.ravel()
+        j = j.ravel()
+        vertices = np.column_stack((i*self.scale, self.heightmap.ravel(), j*self.scale))
+        uvs = np.column_stack((i/(size-1), j/(size-1)))
+        return vertices, grid_triangles(size), uvs
+
+
+def surface_normals(dx, dz):
+    """
+    Unit normals (shape + (3,)) of a height field y = h(x, z) from its slopes.
+    """
+    n = np.stack((-np.asarray(dx, dtype=float), np.ones(np.shape(dx)), -np.asarray(dz, dtype=float)), axis=-1)
+    return n / np.linalg.norm(n, axis=-1, keepdims=True)
+
+
+def grid_triangles(n):
+    """
+    Flat triangle indices of an n x n vertex grid stored row-major, two
+    triangles per quad (same winding as the original loops).
+    """
+    idx = (np.arange(n-1)[:, None]*n + np.arange(n-1)[None, :]).ravel()
+    return np.column_stack((idx, idx+1, idx+n, idx+1, idx+n+1, idx+n)).ravel()
+
+
+class ChunkedTerrain:
+    """
+    Procedural terrain of cells x cells cells split in square chunks, for
+    worlds far larger than the 64x64 heightmap. Heights are evaluated from
+    the same sinusoidal law as Terrain (one period every period cells), so no
+    grid is allocated: only the chunks around the tornadoes are meshed, at a
+    level of detail that drops with distance (see TwisterRender.TerrainStreamer).
+
+    chunk_size   : cells per chunk side, a divisor of cells and a multiple of
+                   2**len(lod_distances)
+    lod_distances: chunk distances (in chunks) at which the LOD drops by one
+                   level; each level halves the vertex density
+    view_radius  : chunks farther than this from every focus point are unloaded
+    """
+
+    def __init__(self, cells=32768, scale=0.7, height_scale=0.8, period=31.5,
+                 chunk_size=64, lod_distances=(1.5, 3.0, 5.0), view_radius=7.0):
+        assert cells % chunk_size == 0 and chunk_size % 2**len(lod_distances) == 0
+        self.size = cells
+        self.scale = scale
+        self.height_scale = height_scale
+        self.period = period
+        self.chunk_size = chunk_size
+        self.lod_distances = np.asarray(lod_distances, dtype=float)
+        self.view_radius = view_radius
+        self.n_chunks = cells // chunk_size
+
+    @property
+    def extent(self):
+        return self.size * self.scale
+
+    def height_field(self, x, z):
+        """
+        Heights at arrays of world coordinates (x along the rows of Terrain,
+        z along its columns).
+        """
+        k = 2*np.pi / (self.period*self.scale)
+        return np.sin(np.asarray(z)*k) * np.cos(np.asarray(x)*k) * self.height_scale
+
+    def heights(self, x, z, normals=False):
+        """
+        Heights (and unit normals, shape + (3,)) at arrays of world
+        coordinates, evaluated exactly from the height law.
+        """
+        x = np.clip(np.asarray(x, dtype=float), 0, self.extent)
+        z = np.clip(np.asarray(z, dtype=float), 0, self.extent)
+        y = self.height_field(x, z)
+        if not normals:
+            return y
+        k = 2*np.pi / (self.period*self.scale)
+        dx = -np.sin(z*k) * np.sin(x*k) * k * self.height_scale
+        dz = np.cos(z*k) * np.cos(x*k) * k * self.height_scale
+        return y, surface_normals(dx, dz)
+
+    def get_height(self, x, z):
+        return float(self.heights(x, z))
+
+    def clamp(self, position, margin=2):
+        position[0] = np.clip(position[0], margin, self.extent - margin)
+        position[2] = np.clip(position[2], margin, self.extent - margin)
+
+    def chunk_origin(self, ci, cj):
+        return ci*self.chunk_size*self.scale, cj*self.chunk_size*self.scale
+
+    def chunk_arrays(self, ci, cj, lod=0):
+        """
+        Vertices (relative to chunk_origin), triangle indices and uvs of chunk
+        (ci, cj) sampled every 2**lod cells. Neighbouring chunks share their
+        border vertices, so same-LOD chunks join without seams.
+        """
+        step = 2**lod
+        n = self.chunk_size // step + 1
+        local = np.arange(n) * step * self.scale
+        lx, lz = np.meshgrid(local, local, indexing='ij')
+        ox, oz = self.chunk_origin(ci, cj)
+        heights = self.height_field(lx + ox, lz + oz)
+        vertices = np.column_stack((lx.ravel(), heights.ravel(), lz.ravel()))
+        uvs = vertices[:, [0, 2]] / (self.chunk_size*self.scale)
+        return vertices, grid_triangles(n), uvs
+
+    def visible_chunks(self, points):
+        """
+        {(ci, cj): lod} of the chunks within view_radius of any of the (x, z)
+        focus points; the LOD of a chunk is set by its nearest focus point.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return {}
+        span = self.chunk_size * self.scale
+        reach = int(np.ceil(self.view_radius))
+        centers = np.floor(points / span).astype(int)
+        lo = np.clip(centers.min(axis=0) - reach, 0, self.n_chunks - 1)
+        hi = np.clip(centers.max(axis=0) + reach, 0, self.n_chunks - 1)
+        ci, cj = np.meshgrid(np.arange(lo[0], hi[0]+1), np.arange(lo[1], hi[1]+1), indexing='ij')
+        # Distance in chunks from every candidate chunk center to every focus point
+        cx = (ci.ravel() + 0.5)[:, None] - points[None, :, 0] / span
+        cz = (cj.ravel() + 0.5)[:, None] - points[None, :, 1] / span
+        dist = np.sqrt(cx*cx + cz*cz).min(axis=1)
+        keep = dist <= self.view_radius
+        lods = np.searchsorted(self.lod_distances, dist[keep])
+        return dict(zip(zip(ci.ravel()[keep].tolist(), cj.ravel()[keep].tolist()), lods.tolist()))
+
+
+# ----------- Atmospheric Model -----------
+def window_min(values, radius, axis):
+    """
+    Minimum of a 2D array over the window [k-radius, k+radius) along axis,
+    and the index where it is reached (first one on ties).
+    """
+    if axis == 1:
+        best, arg = window_min(np.ascontiguousarray(values.T), radius, 0)
+        return best.T, arg.T
+    n = values.shape[0]
+    best = np.full(values.shape, np.inf)
+    arg = np.zeros(values.shape, dtype=np.intp)
+    rows = np.broadcast_to(np.arange(n)[:, None], values.shape)
+    mask = np.empty(values.shape, dtype=bool)
+    for offset in range(-radius, radius):
+        lo, hi = max(0, -offset), min(n, n - offset)
+        candidate = values[lo+offset:hi+offset]
+        m = mask[lo:hi]
+        np.less(candidate, best[lo:hi], out=m)
+        np.copyto(best[lo:hi], candidate, where=m)
+        np.copyto(arg[lo:hi], rows[lo+offset:hi+offset], where=m)
+    return best, arg
+
+
+class AtmosphericModel:
+    """
+    Pressure, temperature and wind grids perturbed by the tornadoes. Each
+    tornado applies a precomputed stencil (one per unique influence radius,
+    in cells: t.influence_radius when set, radius otherwise, and vortex
+    profile) to a slice of the grids. Stencils follow the profile of the
+    tornado (TwisterVortex) with a core of core_fraction * radius cells:
+    the cyclostrophic pressure deficit and the horizontal wind, both
+    normalized to 1 at their peak.
+
+    incremental  : keep the grids between updates and only undo/redo the
+                   stencils of tornadoes whose cell, radius or intensity
+                   changed; a full rebuild every rebuild_every updates
+                   bounds the floating-point drift
+    search_radius: half width of the window scanned by the pressure-seeking
+                   AI; the lowest-pressure cell of every window is cached
+                   once per update (see descent_target)
+    """
+
+    def __init__(self, size, scale, radius=8, incremental=False, rebuild_every=1000, search_radius=8,
+                 core_fraction=0.25):
+        self.size = size
+        self.scale = scale
+        self.radius = radius
+        self.core_fraction = core_fraction
+        self.incremental = incremental
+        self.rebuild_every = rebuild_every
+        self.pressure = np.full((size, size), 1000.0)
+        self.temperature = np.full((size, size), 25.0)
+        self.wind = np.zeros((size, size, 2))
+        self.stencils = {}
+        self.contributions = {}
+        self.updates = 0
+        self.search_radius = search_radius
+        self.target_cells = None
+
+    def stencil(self, radius, profile=RANKINE):
+        # Pressure deficit weights inside the disc dist < radius (1 at the
+        # center), and the tangential + radial wind of the profile
+        s = self.stencils.get((radius, profile))
+        if s is None:
+            d = np.arange(-radius, radius)
+            di, dj = np.meshgrid(d, d, indexing='ij')
+            dist = np.sqrt(di**2 + dj**2)
+            rho = dist / (self.core_fraction * radius)
+            inside = dist < radius
+            w = np.where(inside, profile.pressure_deficit(rho) / profile.pressure_deficit(0.0), 0.0)
+            v_t = profile.f(rho)
+            v_r = profile.g(rho) * taper(rho)
+            peak = max(np.abs(v_t).max(), np.abs(v_r).max(), 1e-12)
+            angle = np.arctan2(dj, di)
+            w_x = np.where(inside, (v_r*np.cos(angle) - v_t*np.sin(angle)) / peak, 0.0)
+            w_z = np.where(inside, (v_r*np.sin(angle) + v_t*np.cos(angle)) / peak, 0.0)
+            s = self.stencils[(radius, profile)] = (w, w_x, w_z)
+        return s
+
+    def influence(self, t):
+        radius = getattr(t, 'influence_radius', None) or self.radius
+        profile = getattr(t, 'profile', RANKINE)
+        return int(t.position[0]//self.scale), int(t.position[2]//self.scale), radius, t.intensity, profile
+
+    def apply(self, cx, cz, radius, intensity, profile=RANKINE, sign=1.0):
+        i0, i1 = max(0, cx-radius), min(self.size, cx+radius)
+        j0, j1 = max(0, cz-radius), min(self.size, cz+radius)
+        if i0 >= i1 or j0 >= j1:
+            return
+        w, w_x, w_z = self.stencil(radius, profile)
+        si = slice(i0-cx+radius, i1-cx+radius)
+        sj = slice(j0-cz+radius, j1-cz+radius)
+        k = sign * intensity
+        self.pressure[i0:i1, j0:j1] -= k * 0.5 * w[si, sj]
+        self.temperature[i0:i1, j0:j1] += k * 0.02 * w[si, sj]
+        self.wind[i0:i1, j0:j1, 0] += k * 0.1 * w_x[si, sj]
+        self.wind[i0:i1, j0:j1, 1] += k * 0.1 * w_z[si, sj]
+
+    def update(self, tornadoes):
+        self.updates += 1
+        self.target_cells = None
+        if not self.incremental or self.updates % self.rebuild_every == 0:
+            self.pressure[:] = 1000.0
+            self.temperature[:] = 25.0
+            self.wind[:] = 0
+            self.contributions.clear()
+            for t in tornadoes:
+                inf = self.influence(t)
+                self.apply(*inf)
+                self.contributions[id(t)] = (t, inf)
+            return
+        current = {id(t): (t, self.influence(t)) for t in tornadoes}
+        for key, (_, inf) in list(self.contributions.items()):
+            new = current.get(key)
+            if new is None or new[1] != inf:
+                self.apply(*inf, sign=-1.0)
+                del self.contributions[key]
+        for key, entry in current.items():
+            if key not in self.contributions:
+                self.apply(*entry[1])
+                self.contributions[key] = entry
+
+    def window_argmin(self):
+        """
+        For every cell (i, j), the cell of lowest pressure in the window
+        [i-R, i+R) x [j-R, j+R) clipped to the grid. Like the scalar scan it
+        replaces, the center wins ties and otherwise the first cell in
+        row-major order does. Separable: a min over j, then over i, each as
+        2R whole-grid comparisons.
+        """
+        n = self.size
+        row_min, arg_j = window_min(self.pressure, self.search_radius, axis=1)
+        best, arg_i = window_min(row_min, self.search_radius, axis=0)
+        target_j = np.take_along_axis(arg_j, arg_i, axis=0)
+        ii, jj = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+        center = self.pressure <= best
+        return np.where(center, ii, arg_i), np.where(center, jj, target_j)
+
+    def descent_target(self, i, j):
+        if self.target_cells is None:
+            self.target_cells = self.window_argmin()
+        return int(self.target_cells[0][i, j]), int(self.target_cells[1][i, j])
+
+    def cell(self, x, z):
+        ix = int(np.clip(x//self.scale, 0, self.size-1))
+        iz = int(np.clip(z//self.scale, 0, self.size-1))
+        return ix, iz
+
+    def get_local(self, x, z):
+        ix, iz = self.cell(x, z)
+        return self.pressure[ix,iz], self.temperature[ix,iz], self.wind[ix,iz]
+
+
+# ----------- Vortex (headless tornado) -----------
+# Particles paused by the visibility stage catch up on at most MAX_CATCHUP
+# seconds, in steps of at most CATCHUP_STEP (s)
+MAX_CATCHUP = 2.0
+CATCHUP_STEP = 0.1
+
+
+class Vortex:
+    """
+    State of one tornado. style selects the particle kinematics:
+    - 'funnel': rotation with updraft, respawn, tilt and oscillation
+    - 'column': rigid rotation of a uniform column (AI tornadoes)
+    profile is the vortex model of the funnel rotation, the wind field and
+    the atmosphere stencils: a TwisterVortex profile or its name ('rankine',
+    'lamb_oseen', 'burgers', 'sullivan'); strain (1/s) scales its radial
+    and vertical flow.
+    color_mode, palette, size_range and alpha_range only describe how the
+    front-ends draw the particles ('speed', 'palette' or 'gradient').
+    wind_speed is the drift of the tornado in units per second.
+    n_debris pieces of debris (TwisterDebris.DebrisField) are lofted by the
+    vortex; they draw from debris_rng (rng by default).
+    particle_interval: the particles and the debris are integrated every
+    particle_interval steps with the dt summed since the last time (0:
+    paused, the time is kept and caught up later, see take_pending); set by
+    the visibility stage of TwisterCulling.py, 1 otherwise.
+    build keeps the construction arguments, see rebuilt.
+    """
+
+    def __init__(self,
+                 position,
+                 n_particles=1000,
+                 height=20,
+                 radius_base=0.25,
+                 radius_top=2.0,
+                 core_radius=0.6,
+                 omega0=7.0,
+                 max_inclination=4.5,
+                 sin_amplitude=0.5,
+                 sin_freq=2.5,
+                 wind_speed=(0, 0, 0),
+                 collider_radius=3.5,
+                 intensity=1.0,
+                 ai_controlled=False,
+                 style='funnel',
+                 n_debris=0,
+                 r_jitter=0.0,
+                 palette=(AZURE,),
+                 color_mode='palette',
+                 size_range=(0.05, 0.18),
+                 alpha_range=(0.9, 0.4),
+                 particles=None,
+                 profile='rankine',
+                 strain=0.5,
+                 rng=None,
+                 debris_rng=None):
+        args = {name: value for name, value in locals().items() if name != 'self'}
+        self.build = (type(self), args, {'rng': _rng_state(rng), 'debris_rng': _rng_state(debris_rng)})
+        self.position = np.array(position, dtype=float)
+        self.n_particles = n_particles
+        self.height = height
+        self.radius_base = radius_base
+        self.radius_top = radius_top
+        self.core_radius = core_radius
+        self.omega0 = omega0
+        self.profile = get_profile(profile)
+        self.strain = strain
+        self.max_inclination = max_inclination
+        self.sin_amplitude = sin_amplitude
+        self.sin_freq = sin_freq
+        self.wind_speed = np.array(wind_speed, dtype=float)
+        self.collider_radius = collider_radius
+        self.intensity = intensity
+        self.ai_controlled = ai_controlled
+        self.style = style
+        self.palette = list(palette)
+        self.color_mode = color_mode
+        self.size_range = size_range
+        self.alpha_range = alpha_range
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.angle = 0.0
+        self.base_y = 0.0
+        self.fusion = False
+        self.fusion_progress = 0.0
+        self.fusion_target = None
+        self.particle_interval = 1
+        self.pending_dt = 0.0
+
+        if particles is not None:
+            self.particles = particles
+        elif style == 'column':
+            self.particles = ParticleStore.column(n_particles, height, radius_base, radius_top, rng=self.rng)
+        else:
+            self.particles = ParticleStore.funnel(n_particles, height, radius_base, radius_top,
+                                                  n_colors=len(self.palette), r_jitter=r_jitter, rng=self.rng)
+        self.n_particles = len(self.particles)
+
+        # Debris: pieces picked up around the tornado base (TwisterDebris.py)
+        self.n_debris = n_debris
+        self.debris = DebrisField(n_debris, (radius_base*0.7, radius_base*5.6),
+                                  recycle_radius=max(12*radius_top, 10*core_radius),
+                                  rng=debris_rng if debris_rng is not None else self.rng)
+
+        # For color mapping (velocity)
+        self.v_theta_max = float(self.profile.tangential(self.radius_top, self.core_radius, self.omega0))
+        self.v_up_max = 1.5
+        self.v_tot_max = np.sqrt(self.v_theta_max**2 + self.v_up_max**2)
+
+    @classmethod
+    def from_intensity(cls, pos=(10, 0, 10), color_base=AZURE, color_top=WHITE, intensity=1.0, ai_controlled=False,
+                       particles=None, rng=None):
+        """
+        Tornado of the AI scenario: geometry and particle count derive from
+        intensity (particles, if given, replaces the freshly drawn column).
+        Its wind is a Lamb-Oseen vortex of unit core and circulation
+        2*pi*3*intensity (far field 3*intensity/r, like the original scripts).
+        """
+        args = dict(pos=pos, color_base=color_base, color_top=color_top, intensity=intensity,
+                    ai_controlled=ai_controlled, particles=particles, rng=rng)
+        states = {'rng': _rng_state(rng)}
+        t = cls(position=pos,
+                   n_particles=300 + int(200*intensity),
+                   height=8 + 2*intensity,
+                   radius_base=0.7 + 0.5*intensity,
+                   radius_top=2.0 + 1.5*intensity,
+                   core_radius=1.0,
+                   omega0=3.0*intensity,
+                   profile='lamb_oseen',
+                   intensity=intensity,
+                   ai_controlled=ai_controlled,
+                   style='column',
+                   palette=(color_base, color_top),
+                   color_mode='gradient',
+                   size_range=(0.15, 0.25),
+                   alpha_range=(0.8, 0.3),
+                   particles=particles,
+                   rng=rng)
+        t.build = (cls.from_intensity, args, states)
+        return t
+
+    def rebuilt(self, **overrides):
+        """
+        The same tornado constructed again with some arguments of its
+        constructor (or of from_intensity) overridden, so that everything
+        derived from them (particles, debris, velocity scale, geometry of
+        from_intensity) follows. The random streams restart from their state
+        at construction: the other draws are those of the original.
+        """
+        factory, args, states = self.build
+        unknown = set(overrides) - set(args)
+        if unknown:
+            raise ValueError('unknown tornado parameter(s) %s (one of %s)'
+                             % (', '.join(sorted(unknown)), ', '.join(sorted(args))))
+        args = dict(args)
+        for name, value in overrides.items():
+            # Integer counts stay integers (sweeps pass floats)
+            if isinstance(args[name], int) and not isinstance(args[name], bool):
+                value = int(round(value))
+            args[name] = value
+        for name, state in states.items():
+            args[name] = _rng_restore(state)
+        return factory(**args)
+
+    @property
+    def debris_pos(self):
+        return self.debris.pos
+
+    @property
+    def x(self):
+        return self.position[0]
+
+    @property
+    def z(self):
+        return self.position[2]
+
+    def move(self, dx, dz):
+        self.position[0] += dx
+        self.position[2] += dz
+
+    def blend_towards_target(self, dt):
+        # Progressive interpolation of every parameter towards the fused tornado
+        target = self.fusion_target
+        self.fusion_progress = min(self.fusion_progress + dt * 0.5, 1.0)
+        p = self.fusion_progress
+        self.position = self.position + (np.asarray(target['position']) - self.position) * p
+        for name in ('height', 'radius_base', 'radius_top', 'core_radius', 'omega0',
+                     'max_inclination', 'sin_amplitude', 'sin_freq', 'collider_radius'):
+            value = getattr(self, name)
+            setattr(self, name, value + (target[name] - value) * p)
+
+    def update(self, dt, clock, terrain, atmo=None):
+        if self.fusion and self.fusion_target is not None:
+            self.blend_towards_target(dt)
+        self.update_particles(dt, clock, terrain, atmo)
+        self.update_debris(dt, terrain, clock)
+
+    def particles_due(self, frame):
+        k = self.particle_interval
+        return k > 0 and frame % k == 0
+
+    def take_pending(self):
+        """
+        Time summed in pending_dt, at most MAX_CATCHUP seconds (the funnel
+        flow is steady, older time would not show), as n steps of dt <=
+        CATCHUP_STEP; returns (dt, n) and resets pending_dt.
+        """
+        total = min(self.pending_dt, MAX_CATCHUP)
+        self.pending_dt = 0.0
+        n = max(int(np.ceil(total / CATCHUP_STEP)), 1)
+        return total / n, n
+
+    def update_particles(self, dt, clock, terrain, atmo=None):
+        # Bare vortex elements (n_particles=0) only carry wind
+        if not self.n_particles:
+            return
+        if self.style == 'column':
+            self.angle += dt * (1.5+self.intensity)
+            wind = atmo.get_local(self.x, self.z)[2] if atmo is not None else (0.0, 0.0)
+            self.base_y = terrain.get_height(self.x, self.z)
+            origin = (self.x + wind[0]*0.5, self.base_y, self.z + wind[1]*0.5)
+            self.particles.spin(self.angle, self, origin)
+            return
+        self.base_y = terrain.get_height(self.x, self.z) + 0.2
+        self.particles.advect(dt, clock, self, (self.x, self.base_y, self.z))
+
+    def update_debris(self, dt, terrain, clock=0.0, wind_grid=None):
+        # Column (AI) tornadoes carry no debris
+        if self.n_debris and self.style != 'column':
+            origin = (self.x, terrain.get_height(self.x, self.z), self.z)
+            self.debris.step(dt, clock, self, origin, terrain, wind_grid)
+
+    def ai_move(self, atmo, dt, other_tornado=None):
+        # Speeds in units/s (0.35 and 0.25 per frame at 60 fps in the original
+        # script); a step never overshoots its target
+        # AI Aggressive: direct pursuit of the main tornado
+        if other_tornado is not None:
+            dx = other_tornado.x - self.x
+            dz = other_tornado.z - self.z
+            norm = np.sqrt(dx*dx + dz*dz)
+            step = min(21.0*dt, norm)
+            if norm > 0.1:
+                self.move(step*dx/norm, step*dz/norm)
+            return
+        # Otherwise, Pressure behavior: lowest pressure cell around (cached field)
+        tx, tz = atmo.descent_target(*atmo.cell(self.x, self.z))
+        dx = tx*atmo.scale - self.x
+        dz = tz*atmo.scale - self.z
+        norm = np.sqrt(dx*dx + dz*dz)
+        step = min(15.0*dt, norm)
+        if norm > 0.1:
+            self.move(step*dx/norm, step*dz/norm)
+
+
+# Each parameter of a progressively fused tornado is weight * (p1 + p2)
+FUSION_WEIGHTS = {
+    'position': 0.5,
+    'height': 0.5,
+    'radius_base': 0.5,
+    'radius_top': 0.7,
+    'core_radius': 0.5,
+    'omega0': 0.5,
+    'max_inclination': 0.5,
+    'sin_amplitude': 0.5,
+    'sin_freq': 0.5,
+    'collider_radius': 1/1.5,
+}
+
+
+def fusion_target(t1, t2, weights=None):
+    # Parameters of the tornado resulting from a progressive fusion
+    weights = dict(FUSION_WEIGHTS, **(weights or {}))
+    return {name: w * (getattr(t1, name) + getattr(t2, name)) for name, w in weights.items()}
+
+
+def fuse_instant(t1, t2):
+    # AI scenario: intensities add up and the new column tornado reuses the
+    # particles of both columns (relabelled for the base/top gradient); it
+    # stays under the player's control if either of them was
+    base = tuple((np.asarray(t1.palette[0]) + np.asarray(t2.palette[0])) / 2)
+    top = tuple((np.asarray(t1.palette[-1]) + np.asarray(t2.palette[-1])) / 2)
+    intensity = t1.intensity + t2.intensity
+    particles = ParticleStore.concatenate([t1.particles, t2.particles], capacity=300 + int(200*intensity))
+    particles.col[:] = np.arange(len(particles)) % 2
+    return Vortex.from_intensity(pos=(t1.position + t2.position)/2,
+                                 color_base=base,
+                                 color_top=top,
+                                 intensity=intensity,
+                                 ai_controlled=t1.ai_controlled and t2.ai_controlled,
+                                 particles=particles,
+                                 rng=t1.rng)
+
+
+def fuse_blended(t1, t2):
+    # End of a progressive fusion: both particle sets are kept in one funnel
+    target = t1.fusion_target
+    particles = ParticleStore.concatenate([t1.particles, t2.particles], [len(t1.palette), len(t2.palette)])
+    return Vortex(position=(t1.position + t2.position)/2,
+                  height=target['height'],
+                  radius_base=target['radius_base'],
+                  radius_top=target['radius_top'],
+                  core_radius=target['core_radius'],
+                  omega0=target['omega0'],
+                  max_inclination=target['max_inclination'],
+                  sin_amplitude=target['sin_amplitude'],
+                  sin_freq=target['sin_freq'],
+                  collider_radius=target['collider_radius'],
+                  intensity=t1.intensity + t2.intensity,
+                  palette=t1.palette + t2.palette,
+                  color_mode=t1.color_mode,
+                  size_range=t1.size_range,
+                  alpha_range=t1.alpha_range,
+                  particles=particles,
+                  profile=t1.profile,
+                  strain=t1.strain,
+                  rng=t1.rng)
+
+
+# ----------- Collisions (broad phase) -----------
+def overlapping_pairs(points, radii):
+    """
+    All pairs (i, j), i < j, of discs that overlap: |p_i - p_j| < r_i + r_j.
+    points is (n, 2), radii a scalar or (n,). Discs are hashed in square
+    cells of side 2*max(radii), so each disc only meets the discs of its own
+    and neighbouring cells: near-linear in n for evenly spread tornadoes.
+    Returns an (m, 2) int array sorted by increasing distance.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    n = len(points)
+    radii = np.broadcast_to(np.asarray(radii, dtype=float), (n,))
+    if n < 2:
+        return np.zeros((0, 2), dtype=int)
+    cell = max(2 * radii.max(), 1e-9)
+    cells = np.floor(points / cell).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    pairs = []
+    # Half of the 3x3 neighbourhood, so that each pair of cells is visited once
+    for di, dj in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        target = keys + di * width + dj
+        start = np.searchsorted(sorted_keys, target, side='left')
+        count = np.searchsorted(sorted_keys, target, side='right') - start
+        i = np.repeat(np.arange(n), count)
+        first = np.repeat(start - np.cumsum(count) + count, count)
+        j = order[first + np.arange(len(i))]
+        if (di, dj) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        pairs.append(np.column_stack((np.minimum(i, j), np.maximum(i, j))))
+    pairs = np.concatenate(pairs)
+    d = np.linalg.norm(points[pairs[:, 0]] - points[pairs[:, 1]], axis=1)
+    hit = d < radii[pairs[:, 0]] + radii[pairs[:, 1]]
+    return pairs[hit][np.argsort(d[hit], kind='stable')]
+
+
+def fusion_queue(pairs):
+    """
+    Greedy selection of disjoint pairs, closest first: every tornado takes part
+    in at most one fusion per step, the others wait for the next step.
+    """
+    used = set()
+    queue = []
+    for i, j in pairs.tolist():
+        if i not in used and j not in used:
+            used.update((i, j))
+            queue.append((i, j))
+    return queue
+
+
+# ----------- Wind Field -----------
+def wind_field(x, z, tornadoes, law=None):
+    """
+    Horizontal wind induced by all the tornadoes at the points (x, z), any
+    array shape, evaluated in one broadcast over (tornado, point).
+    Returns an array of shape x.shape + (2,) holding (wind_x, wind_z):
+    tangential and radial velocity of the vortex profile of each tornado
+    (TwisterVortex) plus the tornado drift. law, a profile or profile name,
+    overrides the profile of every tornado.
+    Points closer than 1e-2 to a tornado center get no contribution from it.
+    """
+    x = np.asarray(x, dtype=float)
+    z = np.asarray(z, dtype=float)
+    out = np.zeros(np.broadcast(x, z).shape + (2,))
+    if not tornadoes:
+        return out
+    shape = (len(tornadoes),) + (1,) * (out.ndim - 1)
+
+    def column(values):
+        return np.asarray(values, dtype=float).reshape(shape)
+
+    rel_x = x - column([t.x for t in tornadoes])
+    rel_z = z - column([t.z for t in tornadoes])
+    r = np.hypot(rel_x, rel_z)
+    valid = r >= 1e-2
+    r = np.where(valid, r, 1.0)
+    core = column([t.core_radius for t in tornadoes])
+    omega0 = column([t.omega0 for t in tornadoes])
+    strain = column([t.strain for t in tornadoes])
+    profiles = [get_profile(law) if law is not None else t.profile for t in tornadoes]
+    if all(p is profiles[0] for p in profiles):
+        p = profiles[0]
+        v_theta = p.tangential(r, core, omega0)
+        v_r = p.radial(r, core, strain)
+    else:
+        # One broadcast per distinct profile
+        v_theta = np.empty_like(r)
+        v_r = np.empty_like(r)
+        for p in set(profiles):
+            k = [i for i, q in enumerate(profiles) if q is p]
+            v_theta[k] = p.tangential(r[k], core[k], omega0[k])
+            v_r[k] = p.radial(r[k], core[k], strain[k])
+    # Tangent (-rel_z, rel_x)/r scaled by v_theta, outward (rel_x, rel_z)/r
+    # by v_r, plus the drift of each tornado
+    scale_t = np.where(valid, v_theta / r, 0.0)
+    scale_r = np.where(valid, v_r / r, 0.0)
+    out[..., 0] = np.sum(-rel_z*scale_t + rel_x*scale_r
+                         + np.where(valid, column([t.wind_speed[0] for t in tornadoes]), 0.0), axis=0)
+    out[..., 1] = np.sum(rel_x*scale_t + rel_z*scale_r
+                         + np.where(valid, column([t.wind_speed[2] for t in tornadoes]), 0.0), axis=0)
+    return out
+
+
+# ----------- Weather -----------
+class Rain:
+    """
+    Rain drops in fixed-capacity arrays. Drops fall at their own speed and
+    respawn at a random altitude when they reach the ground. The number of
+    drops follows drops_per_intensity * (max tornado intensity), capped by
+    capacity: it grows by at most spawn_per_step drops per step and, when the
+    intensity falls, landing drops are retired instead of respawned. Nothing
+    is allocated after construction. With a wind grid (TwisterFluid.WindGrid)
+    the drops also drift with the sampled wind, wrapping around the terrain.
+    """
+
+    def __init__(self, extent, capacity=1000, drops_per_intensity=200, spawn_per_step=5,
+                 altitude=(10.0, 20.0), fall_speed=(8.0, 12.0), rng=None):
+        self.extent = extent
+        self.capacity = capacity
+        self.drops_per_intensity = drops_per_intensity
+        self.spawn_per_step = spawn_per_step
+        self.altitude = altitude
+        self.fall_speed = fall_speed
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.pos = np.zeros((capacity, 3))
+        self.speed = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.count = 0
+
+    def target(self, tornadoes):
+        max_int = max([t.intensity for t in tornadoes]) if tornadoes else 0
+        return min(self.capacity, int(self.drops_per_intensity * max_int))
+
+    def respawn(self, idx):
+        n = len(idx)
+        self.pos[idx, 0] = self.rng.uniform(0, self.extent, n)
+        self.pos[idx, 1] = self.rng.uniform(*self.altitude, n)
+        self.pos[idx, 2] = self.rng.uniform(0, self.extent, n)
+        self.speed[idx] = self.rng.uniform(*self.fall_speed, n)
+
+    def update(self, dt, tornadoes, terrain, wind_grid=None):
+        target = self.target(tornadoes)
+        alive = self.alive
+        self.pos[alive, 1] -= dt * self.speed[alive]
+        if wind_grid is not None:
+            drops = self.pos[alive]
+            wind_grid.advect(drops, dt)
+            drops[:, 0::2] %= self.extent
+            self.pos[alive] = drops
+        landed = np.flatnonzero(alive)
+        landed = landed[self.pos[landed, 1] < terrain.heights(self.pos[landed, 0], self.pos[landed, 2])]
+        excess = self.count - target
+        if excess > 0:
+            retired = landed[:excess]
+            alive[retired] = False
+            self.count -= len(retired)
+            landed = landed[excess:]
+        self.respawn(landed)
+        if self.count < target:
+            born = np.flatnonzero(~alive)[:min(self.spawn_per_step, target - self.count)]
+            self.respawn(born)
+            alive[born] = True
+            self.count += len(born)
+
+    def positions(self):
+        return self.pos[self.alive]
+
+
+# ----------- Simulation -----------
+class SimulationState:
+    def __init__(self, tornadoes):
+        self.tornadoes = list(tornadoes)
+        self.time = 0.0
+        self.frame = 0
+        self.fusion_phase = False
+        self.fusion_timer = 0.0
+        self.fusions = 0
+
+
+class Simulation:
+    """
+    terrain     : Terrain
+    tornadoes   : list of Vortex
+    atmosphere  : AtmosphericModel or None
+    fusion      : None, 'blend' (progressive fusion of two tornadoes) or
+                  'instant' (AI scenario)
+    clamp_margin: keep tornadoes inside the terrain (None to disable)
+    wind_law    : None (vortex profile of every tornado) or a profile name
+                  used for all of them by wind_at, see wind_field
+    rain        : Rain or None
+    wind_grid   : TwisterFluid.WindGrid forced by the tornadoes and stepped
+                  with the simulation, or None; when set, wind_at samples it
+                  instead of the analytic wind_field, the rain drifts in it
+                  and the debris take their horizontal wind from it
+    interaction : tornadoes advect each other with the wind they induce
+                  (Fujiwhara effect), on top of their drift and AI moves
+    tree_theta  : accuracy of the Barnes-Hut evaluation (TwisterTree) used by
+                  the interaction and by wind_at from tree_min tornadoes on
+                  (0: exact sum, larger: faster and coarser)
+    fusion_weights: overrides of FUSION_WEIGHTS for the 'blend' fusion
+    seed        : seed of the RngPlan the scenario was built with
+    replay      : ReplayLog recording the dt and inputs of step/move_player, or None
+    profiler    : TwisterProfile.FrameProfiler timing the stages of step
+                  (a no-op NullProfiler by default)
+    """
+
+    def __init__(self, terrain, tornadoes, atmosphere=None, fusion=None, fusion_duration=100.0,
+                 fusion_distance=5.0, clamp_margin=None, wind_law=None, rain=None, fusion_weights=None,
+                 seed=None, wind_grid=None, interaction=False, tree_theta=0.5, tree_min=64):
+        self.terrain = terrain
+        self.seed = seed
+        self.replay = None
+        self.profiler = NULL_PROFILER
+        self.fusion_weights = fusion_weights
+        self.rain = rain
+        self.wind_law = wind_law
+        self.wind_grid = wind_grid
+        self.interaction = interaction
+        self.tree_theta = tree_theta
+        self.tree_min = tree_min
+        self.atmosphere = atmosphere
+        self.fusion = fusion
+        self.fusion_duration = fusion_duration
+        self.fusion_distance = fusion_distance
+        self.clamp_margin = clamp_margin
+        self.state = SimulationState(tornadoes)
+
+    @property
+    def tornadoes(self):
+        return self.state.tornadoes
+
+    def step(self, dt):
+        s = self.state
+        prof = self.profiler
+        if self.replay is not None:
+            self.replay.record_step(dt)
+        if self.atmosphere is not None:
+            with prof.stage('atmosphere'):
+                self.atmosphere.update(s.tornadoes)
+        if self.rain is not None:
+            with prof.stage('weather'):
+                self.rain.update(dt, s.tornadoes, self.terrain, self.wind_grid)
+        with prof.stage('move'):
+            self.move(dt)
+        if self.wind_grid is not None:
+            with prof.stage('wind'):
+                self.wind_grid.step(dt, s.tornadoes)
+        if self.fusion == 'instant':
+            with prof.stage('fusion'):
+                fused = self.fuse_colliding()
+        else:
+            fused = ()
+        if self.fusion == 'blend':
+            self.start_fusion()
+        due = []
+        with prof.stage('advect'):
+            for t in s.tornadoes:
+                if any(t is f for f in fused):
+                    # A tornado fused in this step is advanced from the next one on
+                    continue
+                if t.fusion and t.fusion_target is not None:
+                    t.blend_towards_target(dt)
+                t.pending_dt += dt
+                if t.particles_due(s.frame):
+                    step, n = t.take_pending()
+                    due.append((t, step, n))
+                    for _ in range(n):
+                        t.update_particles(step, s.time, self.terrain, self.atmosphere)
+        with prof.stage('debris'):
+            for t, step, n in due:
+                for _ in range(n):
+                    t.update_debris(step, self.terrain, s.time, self.wind_grid)
+        if s.fusion_phase and s.fusion_timer > self.fusion_duration:
+            with prof.stage('fusion'):
+                t1, t2 = s.tornadoes
+                s.tornadoes[:] = [fuse_blended(t1, t2)]
+                s.fusion_phase = False
+                s.fusions += 1
+        self.advance_clock(dt)
+        return s
+
+    def advance_clock(self, dt):
+        self.state.time += dt
+        self.state.frame += 1
+
+    def move(self, dt):
+        s = self.state
+        if s.fusion_phase:
+            s.fusion_timer += dt
+        for t in s.tornadoes:
+            t.position += t.wind_speed * dt
+        if self.interaction and len(s.tornadoes) > 1:
+            with self.profiler.stage('interaction'):
+                self.mutual_advection(dt)
+        if self.clamp_margin is not None:
+            for t in s.tornadoes:
+                self.terrain.clamp(t.position, self.clamp_margin)
+        with self.profiler.stage('ai'):
+            self.ai_step(dt)
+
+    def mutual_advection(self, dt):
+        # Every tornado moves with the wind induced by the others at its center
+        ts = self.state.tornadoes
+        tree = VortexTree.from_tornadoes(ts, self.wind_law, theta=self.tree_theta)
+        vel = tree.velocity([t.x for t in ts], [t.z for t in ts])
+        for t, v in zip(ts, vel):
+            t.position[0] += v[0] * dt
+            t.position[2] += v[1] * dt
+
+    def ai_step(self, dt):
+        ts = self.state.tornadoes
+        if self.atmosphere is None or not ts:
+            return
+        # Aggressive AI: every AI tornado chases the first (player) tornado
+        if len(ts) > 1:
+            player_tornado = ts[0]
+            for t in ts[1:]:
+                if t.ai_controlled:
+                    t.ai_move(self.atmosphere, dt, other_tornado=player_tornado)
+        elif ts[0].ai_controlled:
+            ts[0].ai_move(self.atmosphere, dt)
+
+    def start_fusion(self):
+        s = self.state
+        if s.fusion_phase or len(s.tornadoes) != 2:
+            return
+        t1, t2 = s.tornadoes
+        dist = np.linalg.norm(t1.position - t2.position)
+        if dist < t1.collider_radius + t2.collider_radius:
+            s.fusion_phase = True
+            s.fusion_timer = 0
+            target = fusion_target(t1, t2, self.fusion_weights)
+            for t in (t1, t2):
+                t.fusion = True
+                t.fusion_target = target
+                t.wind_speed = (target['position'] - t.position) / self.fusion_duration
+
+    def fuse_colliding(self):
+        # Every pair closer than fusion_distance merges; several merges per
+        # step. The fused tornado takes the slot of the lower index, so the
+        # player (ts[0]) keeps its slot. Returns the fused tornadoes.
+        ts = self.state.tornadoes
+        if len(ts) < 2:
+            return []
+        points = np.array([t.position[[0, 2]] for t in ts])
+        queue = fusion_queue(overlapping_pairs(points, self.fusion_distance / 2))
+        if not queue:
+            return []
+        slots = {}
+        for i, j in queue:
+            i, j = min(i, j), max(i, j)
+            slots[i] = fuse_instant(ts[i], ts[j])
+            slots[j] = None
+        ts[:] = [slots.get(k, t) for k, t in enumerate(ts) if slots.get(k, t) is not None]
+        self.state.fusions += len(queue)
+        return [f for f in slots.values() if f is not None]
+
+    def wind_at(self, x, z):
+        ts = self.state.tornadoes
+        if self.wind_grid is not None:
+            return self.wind_grid.sample(x, z)
+        if len(ts) >= self.tree_min:
+            out = VortexTree.from_tornadoes(ts, self.wind_law, theta=self.tree_theta).velocity(x, z)
+            out += np.sum([t.wind_speed[[0, 2]] for t in ts], axis=0)
+            return out
+        return wind_field(x, z, ts, self.wind_law)
+
+    def move_player(self, dx, dz):
+        if self.replay is not None:
+            self.replay.record_input(self.state.frame, dx, dz)
+        ts = self.state.tornadoes
+        if ts and not ts[0].ai_controlled:
+            ts[0].move(dx, dz)
+
+
+# ----------- Fixed Timestep -----------
+class FixedStepper:
+    """
+    Runs a Simulation at a fixed rate (Hz) whatever the frame rate: each
+    advance(frame_dt) performs the whole steps that fit in the accumulated
+    time, at most max_substeps of them (the rest is dropped, so a slow frame
+    slows the simulation down instead of snowballing). alpha, the fraction of
+    a step left in the accumulator, blends the last two physics states for
+    rendering (particle_positions, debris_positions).
+    """
+
+    def __init__(self, sim, rate=60.0, max_substeps=5):
+        self.sim = sim
+        self.dt = 1.0 / rate
+        self.max_substeps = max_substeps
+        self.accumulator = 0.0
+        self.alpha = 1.0
+        self.previous = {}
+        self.buffers = {}
+
+    def advance(self, frame_dt):
+        self.accumulator += frame_dt
+        n = min(int(self.accumulator / self.dt), self.max_substeps)
+        for k in range(n):
+            if k == n - 1:
+                # Only the particles integrated by this step need their previous state
+                frame = self.sim.state.frame
+                self.previous = {id(t): (t.particles.pos.copy(), t.debris_pos.copy())
+                                 for t in self.sim.tornadoes if t.particles_due(frame)}
+            self.sim.step(self.dt)
+            self.accumulator -= self.dt
+        if self.accumulator >= self.dt:
+            self.accumulator %= self.dt
+        self.alpha = self.accumulator / self.dt
+        return n
+
+    def blend(self, t, current, which, index=None):
+        # index: blend only these rows (the particles drawn by the LOD)
+        prev = self.previous.get(id(t))
+        if prev is None or len(prev[which]) != len(current):
+            return current if index is None else current[index]
+        prev = prev[which]
+        if index is not None:
+            current = current[index]
+            prev = prev[index]
+        key = (id(t), which)
+        out = self.buffers.get(key)
+        if out is None or out.shape != current.shape:
+            out = self.buffers[key] = np.empty_like(current)
+        np.subtract(current, prev, out=out)
+        out *= self.alpha
+        out += prev
+        # Particles respawned at the ground jump instead of sweeping the funnel
+        jump = current[:, 1] < prev[:, 1] - 0.5
+        out[jump] = current[jump]
+        return out
+
+    def particle_positions(self, t, index=None):
+        return self.blend(t, t.particles.pos, 0, index)
+
+    def debris_positions(self, t):
+        return self.blend(t, t.debris_pos, 1)
+
+
+# ----------- Record / Replay -----------
+class ReplayLog:
+    """
+    Everything a run depends on besides the code: scenario name, seed, the dt
+    of every step (run-length encoded, a fixed dt costs a few bytes) and the
+    player inputs with the frame they were received on. play() rebuilds the
+    scenario and feeds the same sequence, giving the same state bit for bit.
+    """
+
+    def __init__(self, scenario, seed):
+        self.scenario = scenario
+        self.seed = seed
+        self.dt_values = []
+        self.dt_counts = []
+        self.inputs = []
+
+    def record_step(self, dt):
+        if self.dt_values and self.dt_values[-1] == dt:
+            self.dt_counts[-1] += 1
+        else:
+            self.dt_values.append(dt)
+            self.dt_counts.append(1)
+
+    def record_input(self, frame, dx, dz):
+        self.inputs.append((frame, dx, dz))
+
+    @property
+    def steps(self):
+        return sum(self.dt_counts)
+
+    def save(self, path):
+        inputs = np.array(self.inputs, dtype=float).reshape(-1, 3)
+        np.savez_compressed(path, scenario=self.scenario, seed=str(self.seed),
+                            dt_values=np.array(self.dt_values, dtype=float),
+                            dt_counts=np.array(self.dt_counts, dtype=np.int64),
+                            input_frames=inputs[:, 0].astype(np.int64), input_moves=inputs[:, 1:])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            log = cls(str(data['scenario']), int(str(data['seed'])))
+            log.dt_values = data['dt_values'].tolist()
+            log.dt_counts = data['dt_counts'].tolist()
+            log.inputs = [(int(f), dx, dz) for f, (dx, dz) in zip(data['input_frames'], data['input_moves'].tolist())]
+        return log
+
+    def play(self, steps=None):
+        """
+        Re-runs the first steps recorded steps (all by default) headless and
+        returns the Simulation.
+        """
+        sim = SCENARIOS[self.scenario](self.seed)
+        dts = np.repeat(self.dt_values, self.dt_counts)[:steps]
+        inputs = iter(self.inputs)
+        pending = next(inputs, None)
+        for dt in dts.tolist():
+            while pending is not None and pending[0] <= sim.state.frame:
+                sim.move_player(pending[1], pending[2])
+                pending = next(inputs, None)
+            sim.step(dt)
+        return sim
+
+
+def record(scenario, seed=None):
+    """
+    Scenario of SCENARIOS with a ReplayLog attached (sim.replay).
+    """
+    sim = SCENARIOS[scenario](seed)
+    sim.replay = ReplayLog(scenario, sim.seed)
+    return sim
+
+
+# ----------- Scenarios -----------
+def one_twister(seed=None, terrain=None):
+    # Single tornado drifting over the terrain (OneTwister.py)
+    plan = RngPlan(seed)
+    terrain = terrain if terrain is not None else Terrain()
+    tornado = Vortex(position=(terrain.extent//4, 0, terrain.extent//2),
+                     n_particles=2500,       # Number of particles representing the tornado
+                     height=20,              # Vertical extent of the tornado
+                     radius_base=0.25,       # Tornado radius at the base (ground level)
+                     radius_top=3.0,         # Tornado radius at the top (altitude = height)
+                     core_radius=1.6,        # Radius of the solid-body rotating core
+                     omega0=7.0,             # Angular velocity at the core (rad/s)
+                     max_inclination=10.0,   # Maximum horizontal displacement (tornado tilt)
+                     sin_amplitude=0.5,      # Amplitude of the tornado's sinusoidal oscillation
+                     sin_freq=2.5,           # Frequency of the oscillation
+                     wind_speed=(2.4, 0, -1.2),  # Drift of the tornado (units/s)
+                     n_debris=100,
+                     r_jitter=5.5,
+                     color_mode='speed',
+                     rng=plan('tornado1'),
+                     debris_rng=plan('debris1'))
+    return Simulation(terrain, [tornado], clamp_margin=2, seed=plan.seed)
+
+
+def large_world(seed=None):
+    # OneTwister on a 32768 x 32768 cells chunked terrain (OneTwister.py, world = 'large')
+    return one_twister(seed, terrain=ChunkedTerrain())
+
+
+def two_twister(seed=None):
+    # Two independent tornadoes (TwoTwister.py)
+    plan = RngPlan(seed)
+    terrain = Terrain()
+    e = terrain.extent
+    t1 = Vortex(position=(e*0.3, 0, e*0.5), n_particles=1200, height=20, radius_base=0.25, radius_top=2.0,
+                core_radius=0.6, omega0=7.0, max_inclination=4.5, sin_amplitude=0.5, sin_freq=2.5,
+                wind_speed=(2.4, 0, -1.2), n_debris=80, color_mode='speed', rng=plan('tornado1'),
+                debris_rng=plan('debris1'))
+    t2 = Vortex(position=(e*0.7, 0, e*0.5), n_particles=900, height=25, radius_base=0.3, radius_top=3.2,
+                core_radius=1.0, omega0=5.5, max_inclination=10.0, sin_amplitude=0.7, sin_freq=3.0,
+                wind_speed=(-1.8, 0, 0.6), n_debris=80, color_mode='speed', rng=plan('tornado2'),
+                debris_rng=plan('debris2'))
+    return Simulation(terrain, [t1, t2], clamp_margin=2, seed=plan.seed)
+
+
+def two_twister_fusion(seed=None, fusion_duration=100.0):
+    # Two tornadoes colliding and merging progressively (TwoTwisterFusion.py)
+    plan = RngPlan(seed)
+    terrain = Terrain()
+    e = terrain.extent
+    t1 = Vortex(position=(e*0.1, 0, e*0.5), n_particles=900, height=20, radius_base=0.25, radius_top=2.0,
+                core_radius=0.6, omega0=7.0, max_inclination=4.5, sin_amplitude=0.5, sin_freq=2.5,
+                wind_speed=(1.8, 0, 0.0), collider_radius=3.2, palette=(AZURE, CYAN),
+                size_range=(0.2, 0.38), rng=plan('tornado1'))
+    t2 = Vortex(position=(e*0.9, 0, e*0.5), n_particles=1900, height=25, radius_base=0.9, radius_top=9.2,
+                core_radius=3.0, omega0=15.5, max_inclination=10.0, sin_amplitude=0.7, sin_freq=3.0,
+                wind_speed=(-11.4, 0, 0.0), collider_radius=3.5, palette=(ORANGE, RED),
+                size_range=(0.2, 0.38), rng=plan('tornado2'))
+    return Simulation(terrain, [t1, t2], fusion='blend', fusion_duration=fusion_duration, seed=plan.seed)
+
+
+def two_twister_fusion_ai(seed=None):
+    # Player tornado chased by an AI tornado in an atmospheric model (TwoTwisterFusionAI.py)
+    plan = RngPlan(seed)
+    terrain = Terrain()
+    tornadoes = [
+        Vortex.from_intensity(pos=(15, 0, 15), color_base=AZURE, color_top=CYAN, intensity=1.2, ai_controlled=False, rng=plan('tornado1')),
+        Vortex.from_intensity(pos=(30, 0, 30), color_base=ORANGE, color_top=RED, intensity=1.6, ai_controlled=True, rng=plan('tornado2'))
+    ]
+    atmo = AtmosphericModel(terrain.size, terrain.scale, incremental=True)
+    rain = Rain(terrain.extent, capacity=1000, rng=plan('rain'))
+    return Simulation(terrain, tornadoes, atmosphere=atmo, fusion='instant', rain=rain,
+                      seed=plan.seed)
+
+
+def swarm(seed=None, n=200):
+    # n small AI tornadoes chasing the player on a wider terrain; they merge
+    # pairwise as they meet, several fusions per step (broad phase)
+    plan = RngPlan(seed)
+    terrain = Terrain(size=256)
+    e = terrain.extent
+    tornadoes = [Vortex.from_intensity(pos=(e/2, 0, e/2), color_base=AZURE, color_top=CYAN, intensity=1.2, rng=plan('tornado1'))]
+    for k, (x, z) in enumerate(plan('placement').uniform(2, e-2, (n-1, 2)), 2):
+        tornadoes.append(Vortex.from_intensity(pos=(x, 0, z), color_base=ORANGE, color_top=RED, intensity=0.1,
+                                               ai_controlled=True, rng=plan('tornado%d' % k)))
+    atmo = AtmosphericModel(terrain.size, terrain.scale, incremental=True)
+    return Simulation(terrain, tornadoes, atmosphere=atmo, fusion='instant', seed=plan.seed)
+
+
+def vortex_clusters(seed=None, n=2000):
+    # Fujiwhara interaction: two clusters of n/2 small Lamb-Oseen vortex
+    # elements (no particles) advect each other through the tree code, orbit
+    # their common center and wind up into one
+    plan = RngPlan(seed)
+    terrain = Terrain(size=256)
+    e = terrain.extent
+    rng = plan('vortices')
+    tornadoes = []
+    for cx in (e/2 - 12, e/2 + 12):
+        for x, z in rng.normal((cx, e/2), 4.0, (n//2, 2)):
+            tornadoes.append(Vortex(position=(x, 0, z), n_particles=0, core_radius=0.5, omega0=100.0/n,
+                                    profile='lamb_oseen', rng=rng))
+    return Simulation(terrain, tornadoes, interaction=True, seed=plan.seed)
+
+
+SCENARIOS = {
+    'one': one_twister,
+    'large': large_world,
+    'two': two_twister,
+    'fusion': two_twister_fusion,
+    'ai': two_twister_fusion_ai,
+    'swarm': swarm,
+    'vortices': vortex_clusters,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a twister scenario without a window.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='fusion')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--dt', type=float, default=1/60)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--record', default=None, help='save the ReplayLog of the run to this .npz file')
+    parser.add_argument('--replay', default=None, help='re-run a ReplayLog saved by --record or a front-end')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.replay:
+        log = ReplayLog.load(args.replay)
+        args.scenario = log.scenario
+        sim = log.play()
+    else:
+        sim = record(args.scenario, args.seed)
+        for _ in range(args.steps):
+            sim.step(args.dt)
+        if args.record:
+            sim.replay.save(args.record)
+    elapsed = time.perf_counter() - start
+    s = sim.state
+    print('scenario %s: %d steps, simulated %.1f s in %.2f s (x%.1f real time)'
+          % (args.scenario, s.frame, s.time, elapsed, s.time / max(elapsed, 1e-9)))
+    print('tornadoes: %d, particles: %d, fusions: %d, seed: %d'
+          % (len(s.tornadoes), sum(t.n_particles for t in s.tornadoes), s.fusions, sim.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Eulerian wind solver: an optional alternative to the analytic wind of
+# TwisterEngine.wind_field. The horizontal wind lives on a periodic square
+# grid (node (i, j) at x = i*scale, z = j*scale, like the terrain) and every
+# step is a "stable fluids" step:
+#   - forcing: around each tornado the grid wind is relaxed towards the
+#     wind of its vortex profile (TwisterVortex) plus its drift
+#   - semi-Lagrangian advection: every node takes the wind found at
+#     (x, z) - dt * wind, by bilinear interpolation (stable for any dt)
+#   - projection: the divergence is removed with FFTs, together with the
+#     viscosity and the drag towards calm air, so a step is O(N log N)
+# The grid carries the rain drops and the debris (TwisterDebris, horizontal
+# wind) and feeds wind_at (mini-map). The funnel particles are deliberately
+# left out: they trace the funnel in the frame of their vortex (radius set
+# by the altitude), which a grid a few nodes across the core cannot resolve.
+# All grids and FFT buffers are allocated once (float32 by default); a
+# step only allocates the forcing windows of the tornadoes (their size
+# grows with forcing_radius * core_radius / scale, not with the grid), so
+# the grid can be much larger than the 64x64 atmosphere:
+#
+#   python TwisterFluid.py --size 1024 --steps 100
+#
+# The solver is 2D (the funnels are thin compared to the terrain, and the
+# particles only need the horizontal wind) and the domain is periodic: wind
+# leaving one side enters the opposite one.
+
+import argparse
+import time
+
+import numpy as np
+
+# numpy >= 2.0 writes FFT results into preallocated arrays (out=)
+_FFT_OUT = int(np.__version__.split('.')[0]) >= 2
+
+
+def _fft_into(fn, a, out, **kwargs):
+    if _FFT_OUT:
+        return fn(a, out=out, **kwargs)
+    out[...] = fn(a, **kwargs)
+    return out
+
+
+# ----------- Wind Grid -----------
+class WindGrid:
+    """
+    size          : nodes per side (periodic domain of size*scale units)
+    scale         : node spacing
+    viscosity     : kinematic viscosity (units^2/s), exact in Fourier space
+    drag          : relaxation rate of the whole field towards calm air (1/s)
+    relax         : time constant of the tornado forcing (s)
+    forcing_radius: radius of the forced disc, in core radii of the tornado
+    """
+
+    def __init__(self, size, scale, viscosity=0.05, drag=0.1, relax=0.25, forcing_radius=6.0, dtype=np.float32):
+        n = self.size = size
+        self.scale = scale
+        self.extent = size * scale
+        self.viscosity = viscosity
+        self.drag = drag
+        self.relax = relax
+        self.forcing_radius = forcing_radius
+        self.wind = np.zeros((2, n, n), dtype)
+        self.advected = np.zeros((2, n, n), dtype)
+        # Advection scratch: back-traced coordinates and their fractional
+        # parts, row offsets (i*n) and columns of the cell corners, samples
+        self.grid_i = np.repeat(np.arange(n, dtype=dtype)[:, None], n, axis=1)
+        self.grid_j = np.repeat(np.arange(n, dtype=dtype)[None, :], n, axis=0)
+        self.fi, self.fj, self.a, self.b, self.c = (np.empty((n, n), dtype) for _ in range(5))
+        self.row0, self.row1, self.col0, self.col1, self.flat = (np.empty((n, n), np.intp) for _ in range(5))
+        # Spectral scratch, rfft layout (n, n//2 + 1): axis 0 is x, axis 1 is z
+        ctype = np.result_type(dtype, np.complex64)
+        self.spectrum = np.empty((2, n, n//2 + 1), ctype)
+        self.dot = np.empty((n, n//2 + 1), ctype)
+        self.tmp = np.empty((n, n//2 + 1), ctype)
+        self.kx = (2*np.pi*np.fft.fftfreq(n, d=scale)).astype(dtype)[:, None]
+        self.kz = (2*np.pi*np.fft.rfftfreq(n, d=scale)).astype(dtype)[None, :]
+        k2 = self.kx**2 + self.kz**2
+        self.k2 = k2
+        self.inv_k2 = np.where(k2 > 0, 1 / np.where(k2 > 0, k2, 1), 0).astype(dtype)
+        self.decay_dt = None
+        self.decay = None
+
+    def step(self, dt, tornadoes):
+        for t in tornadoes:
+            self.force(dt, t)
+        self.advect_field(dt)
+        self.project(dt)
+
+    # ----------- Forcing -----------
+    def force(self, dt, t):
+        """
+        Relaxes the wind of the disc around t towards its profile wind, with
+        a weight (1 - exp(-dt/relax)) * (1 - (r/R)^2)^2 that vanishes on the rim.
+        """
+        n, h = self.size, self.scale
+        R = max(self.forcing_radius * t.core_radius, 2 * h)
+        half = min(int(np.ceil(R / h)), n // 2)
+        ci, cj = int(round(t.x / h)), int(round(t.z / h))
+        offsets = np.arange(-half, half + 1)
+        # Node positions relative to the tornado, nearest periodic image
+        rel_x = ((ci + offsets) * h - t.x)[:, None]
+        rel_z = ((cj + offsets) * h - t.z)[None, :]
+        r = np.hypot(rel_x, rel_z)
+        valid = r >= 1e-2
+        r = np.where(valid, r, 1.0)
+        v_t = t.profile.tangential(r, t.core_radius, t.omega0)
+        v_r = t.profile.radial(r, t.core_radius, t.strain)
+        target_x = np.where(valid, (-rel_z*v_t + rel_x*v_r) / r, 0.0) + t.wind_speed[0]
+        target_z = np.where(valid, (rel_x*v_t + rel_z*v_r) / r, 0.0) + t.wind_speed[2]
+        w = (1 - np.exp(-dt / self.relax)) * np.clip(1 - (r / R)**2, 0, None)**2
+        window = np.ix_((ci + offsets) % n, (cj + offsets) % n)
+        for k, target in ((0, target_x), (1, target_z)):
+            u = self.wind[k][window]
+            self.wind[k][window] = u + w * (target - u)
+
+    # ----------- Advection -----------
+    def advect_field(self, dt):
+        # Back-trace of every node, in index units
+        u, v = self.wind
+        np.multiply(u, -dt / self.scale, out=self.a)
+        self.a += self.grid_i
+        np.multiply(v, -dt / self.scale, out=self.b)
+        self.b += self.grid_j
+        self.corners(self.a, self.b)
+        for k in range(2):
+            self.gather(self.wind[k], self.advected[k])
+        self.wind, self.advected = self.advected, self.wind
+
+    def corners(self, bi, bj):
+        # Wrapped corners of the cell holding (bi, bj) and the offsets in it
+        n = self.size
+        for b, frac, lo, hi, mul in ((bi, self.fi, self.row0, self.row1, n), (bj, self.fj, self.col0, self.col1, 1)):
+            np.floor(b, out=frac)
+            np.copyto(lo, frac, casting='unsafe')
+            np.subtract(b, frac, out=frac)
+            np.remainder(lo, n, out=lo)
+            np.add(lo, 1, out=hi)
+            np.remainder(hi, n, out=hi)
+            if mul != 1:
+                lo *= mul
+                hi *= mul
+
+    def gather(self, field, out):
+        # Bilinear interpolation at the corners set by corners(), into out
+        f = field.ravel()
+        a, b, c, flat = self.a, self.b, self.c, self.flat
+        np.add(self.row0, self.col0, out=flat)
+        np.take(f, flat, out=a, mode='clip')
+        np.add(self.row0, self.col1, out=flat)
+        np.take(f, flat, out=b, mode='clip')
+        b -= a
+        b *= self.fj
+        a += b
+        np.add(self.row1, self.col0, out=flat)
+        np.take(f, flat, out=b, mode='clip')
+        np.add(self.row1, self.col1, out=flat)
+        np.take(f, flat, out=c, mode='clip')
+        c -= b
+        c *= self.fj
+        b += c
+        b -= a
+        b *= self.fi
+        np.add(a, b, out=out)
+
+    # ----------- Projection -----------
+    def project(self, dt):
+        """
+        Removes the divergent part of the wind (Helmholtz projection in
+        Fourier space, the mean wind is kept) and applies viscosity and drag.
+        """
+        if dt != self.decay_dt:
+            self.decay = np.exp(-(self.viscosity * self.k2 + self.drag) * dt).astype(self.kx.dtype)
+            self.decay_dt = dt
+        # rfft2 as two passes into the preallocated spectra; 'ortho' on both
+        # sides because numpy casts float32 input to float64 (temporaries)
+        # for the unscaled forward transform
+        U, V = self.spectrum
+        for k, S in ((0, U), (1, V)):
+            _fft_into(np.fft.rfft, self.wind[k], S, axis=1, norm='ortho')
+            _fft_into(np.fft.fft, S, S, axis=0, norm='ortho')
+        dot, tmp = self.dot, self.tmp
+        np.multiply(U, self.kx, out=dot)
+        np.multiply(V, self.kz, out=tmp)
+        dot += tmp
+        dot *= self.inv_k2
+        np.multiply(dot, self.kx, out=tmp)
+        U -= tmp
+        np.multiply(dot, self.kz, out=tmp)
+        V -= tmp
+        for k, S in ((0, U), (1, V)):
+            S *= self.decay
+            _fft_into(np.fft.ifft, S, tmp, axis=0, norm='ortho')
+            _fft_into(np.fft.irfft, tmp, self.wind[k], n=self.size, axis=1, norm='ortho')
+
+    def divergence(self):
+        """
+        Largest |div wind| (spectral derivatives), for checks.
+        """
+        U = np.fft.rfft2(self.wind[0])
+        V = np.fft.rfft2(self.wind[1])
+        div = np.fft.irfft2(1j * (self.kx * U + self.kz * V), s=self.wind[0].shape)
+        return float(np.abs(div).max())
+
+    # ----------- Sampling -----------
+    def sample(self, x, z):
+        """
+        Bilinear wind at the points (x, z), any array shape; returns
+        x.shape + (2,) like TwisterEngine.wind_field.
+        """
+        n = self.size
+        fx = np.asarray(x, dtype=float) / self.scale
+        fz = np.asarray(z, dtype=float) / self.scale
+        fx, fz = np.broadcast_arrays(fx, fz)
+        i0 = np.floor(fx)
+        j0 = np.floor(fz)
+        tx = fx - i0
+        tz = fz - j0
+        i0 = i0.astype(np.intp) % n
+        j0 = j0.astype(np.intp) % n
+        i1 = (i0 + 1) % n
+        j1 = (j0 + 1) % n
+        out = np.empty(fx.shape + (2,))
+        for k in range(2):
+            f = self.wind[k]
+            a = f[i0, j0] + (f[i0, j1] - f[i0, j0]) * tz
+            b = f[i1, j0] + (f[i1, j1] - f[i1, j0]) * tz
+            out[..., k] = a + (b - a) * tx
+        return out
+
+    def advect(self, pos, dt):
+        """
+        Moves points (n, 3) with the horizontal wind, in place.
+        """
+        wind = self.sample(pos[:, 0], pos[:, 2])
+        pos[:, 0] += dt * wind[:, 0]
+        pos[:, 2] += dt * wind[:, 1]
+        return pos
+
+
+def main():
+    from TwisterEngine import SCENARIOS
+    parser = argparse.ArgumentParser(description='Time the wind grid solver on a headless scenario.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='two')
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--dt', type=float, default=1/60)
+    args = parser.parse_args()
+
+    sim = SCENARIOS[args.scenario](0)
+    grid = WindGrid(args.size, sim.terrain.extent / args.size)
+    grid.step(args.dt, sim.tornadoes)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        sim.step(args.dt)
+        grid.step(args.dt, sim.tornadoes)
+    elapsed = time.perf_counter() - start
+    speed = np.hypot(*grid.wind)
+    print('%dx%d grid: %.2f ms per step (simulation included), max wind %.2f, max |div| %.2e'
+          % (args.size, args.size, elapsed / args.steps * 1e3, speed.max(), grid.divergence()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Optional compiled kernels for the particle engine (TwisterParticles.py).
+# When Numba is installed, ParticleStore.advect runs as one fused loop over
+# the particles (tangential velocity, theta/z integration, respawn test, tilt
+# and oscillation of the axis, funnel radius, world position, speed), in
+# parallel across cores for large stores. Without Numba, or with the
+# environment variable TWISTER_BACKEND=numpy, the NumPy path is used. The
+# kernel knows the Rankine profile and any tabulated profile (lookup table of
+# TwisterVortex.tabulate); other profiles also take the NumPy path.
+#
+# The respawn angles are still drawn by the NumPy generator of the store,
+# after the kernel and in particle order, so both backends consume the same
+# random stream and agree to float64 round-off.
+#
+# Kernels are compiled with cache=True: the first launch compiles them once
+# (a few seconds) and stores the machine code next to this file, later
+# launches load it. Warm up ahead of time with:
+#
+#   python TwisterKernels.py
+#
+# Numba itself is only imported when the kernels are first needed (importing
+# it and loading the cached kernels takes about a second). The front-ends call
+# load(background=True) so that this happens in a thread after the window is
+# up: the particles take the NumPy path until the kernels are ready.
+
+import importlib.util
+import os
+import threading
+import time
+
+import numpy as np
+from TwisterVortex import RANKINE, TabulatedProfile, tabulate
+
+numba = None
+_installed = importlib.util.find_spec('numba') is not None
+_loaded = threading.Event()
+_loading = threading.Lock()
+_loader = None
+# numba.prange once load() has imported Numba (the loop of _advect_parallel_loop)
+prange = range
+
+# Stores smaller than this use the single-threaded kernel (thread start-up
+# costs more than it saves). With NUMBA_NUM_THREADS=1 every store does: the
+# parallel kernel is then the serial one.
+PARALLEL_THRESHOLD = 50000
+
+_backend = os.environ.get('TWISTER_BACKEND', 'numba' if _installed else 'numpy')
+if _backend == 'numba' and not _installed:
+    _backend = 'numpy'
+
+
+def backend():
+    return _backend
+
+
+def set_backend(name):
+    """
+    'numba' (if installed) or 'numpy'.
+    """
+    global _backend
+    if name not in ('numba', 'numpy'):
+        raise ValueError('unknown backend %r' % name)
+    if name == 'numba' and not _installed:
+        raise ImportError('numba is not installed')
+    _backend = name
+
+
+def enabled():
+    if _backend != 'numba':
+        return False
+    if not _loaded.is_set() and _loader is None:
+        load()
+    return _loaded.is_set()
+
+
+def load(background=False):
+    """
+    Imports Numba and compiles (or loads from the cache) the kernels.
+    background=True returns at once and does it in a thread, advect takes
+    the NumPy path until it is done.
+    """
+    global numba, prange, _advect_particle, _advect_parallel, _advect_serial, _loader
+    if _backend != 'numba' or _loaded.is_set():
+        return
+    if background:
+        with _loading:
+            if _loader is None:
+                _loader = threading.Thread(target=load, daemon=True, name='twister-kernels')
+                _loader.start()
+        return
+    with _loading:
+        if numba is None:
+            import numba
+            prange = numba.prange
+            _advect_particle = numba.njit(inline='always', cache=True)(_advect_particle)
+            # Two distinct functions: the on-disk cache is keyed on the function,
+            # one function wrapped twice would load the serial code for both
+            _advect_serial = numba.njit(cache=True)(_advect_serial_loop)
+            if numba.config.NUMBA_NUM_THREADS > 1:
+                _advect_parallel = numba.njit(parallel=True, cache=True)(_advect_parallel_loop)
+            else:
+                # A single thread: the parallel kernel would only add its scheduling
+                _advect_parallel = _advect_serial
+    warmup()
+    _loaded.set()
+
+
+# ----------- Kernels -----------
+def _advect_particle(i, r, theta, z, pos, speed, respawn, table, table_step, dt, clock, height, radius_base,
+                     radius_top, core_radius, omega0, max_inclination, sin_amplitude, sin_freq, ox, oy, oz):
+    # One particle; table: f(rho) of a TabulatedProfile on [0, (len-1)*table_step], empty for Rankine
+    n_table = len(table)
+    ri = r[i]
+    if n_table == 0:
+        if ri < core_radius:
+            v_theta = omega0 * ri
+        else:
+            v_theta = omega0 * core_radius**2 / max(ri, 1e-12)
+    else:
+        u = ri / core_radius / table_step
+        k = int(u)
+        if k < n_table - 1:
+            u -= k
+            v_theta = omega0 * core_radius * (table[k] * (1.0 - u) + table[k + 1] * u)
+        else:
+            v_theta = omega0 * core_radius**2 / max(ri, 1e-12)
+    v_up = 2.0 + (0.5 - 2.0) * (ri / radius_top)
+    th = theta[i] + dt * v_theta / (ri + 1e-3)
+    zi = z[i] + dt * v_up
+    respawn[i] = zi > height
+    if respawn[i]:
+        zi = 0.0
+    frac = zi / height
+    phase = sin_freq * frac * np.pi
+    x_axis = max_inclination * frac + sin_amplitude * np.sin(phase + clock)
+    z_axis = sin_amplitude * np.cos(phase + clock * 0.8)
+    ri = radius_base + (radius_top - radius_base) * frac**1.5
+    theta[i] = th
+    z[i] = zi
+    r[i] = ri
+    pos[i, 0] = ox + x_axis + ri * np.cos(th)
+    pos[i, 1] = oy + zi
+    pos[i, 2] = oz + z_axis + ri * np.sin(th)
+    speed[i] = np.sqrt(v_theta**2 + v_up**2)
+
+
+def _advect_serial_loop(r, theta, z, pos, speed, respawn, table, table_step, dt, clock, height, radius_base,
+                        radius_top, core_radius, omega0, max_inclination, sin_amplitude, sin_freq, ox, oy, oz):
+    for i in range(len(r)):
+        _advect_particle(i, r, theta, z, pos, speed, respawn, table, table_step, dt, clock, height, radius_base,
+                         radius_top, core_radius, omega0, max_inclination, sin_amplitude, sin_freq, ox, oy, oz)
+
+
+def _advect_parallel_loop(r, theta, z, pos, speed, respawn, table, table_step, dt, clock, height, radius_base,
+                          radius_top, core_radius, omega0, max_inclination, sin_amplitude, sin_freq, ox, oy, oz):
+    for i in prange(len(r)):
+        _advect_particle(i, r, theta, z, pos, speed, respawn, table, table_step, dt, clock, height, radius_base,
+                         radius_top, core_radius, omega0, max_inclination, sin_amplitude, sin_freq, ox, oy, oz)
+
+
+_NO_TABLE = np.zeros(0)
+
+
+def supports(profile):
+    """
+    Profiles the kernel evaluates: Rankine and every tabulated profile.
+    """
+    return profile is RANKINE or isinstance(profile, TabulatedProfile)
+
+
+def advect(store, dt, clock, vortex, origin):
+    """
+    Compiled equivalent of ParticleStore.advect.
+    """
+    profile = getattr(vortex, 'profile', RANKINE)
+    if profile is RANKINE:
+        table, table_step = _NO_TABLE, 1.0
+    else:
+        table, table_step = profile.tables['f'], profile.step
+    n = len(store)
+    respawn = getattr(store, '_respawn', None)
+    if respawn is None or len(respawn) != n:
+        respawn = store._respawn = np.zeros(n, dtype=np.bool_)
+    kernel = _advect_parallel if n >= PARALLEL_THRESHOLD else _advect_serial
+    kernel(store.r, store.theta, store.z, store.pos, store.speed, respawn, table, table_step, float(dt), float(clock),
+           float(vortex.height), float(vortex.radius_base), float(vortex.radius_top), float(vortex.core_radius),
+           float(vortex.omega0), float(vortex.max_inclination), float(vortex.sin_amplitude), float(vortex.sin_freq),
+           float(origin[0]), float(origin[1]), float(origin[2]))
+    top = np.flatnonzero(respawn)
+    if len(top):
+        # Respawned particles (z = 0) get their new angle from the store generator
+        store.theta[top] = store.rng.uniform(0, 2 * np.pi, len(top))
+        r = store.r[top]
+        store.pos[top, 0] = origin[0] + vortex.sin_amplitude * np.sin(clock) + r * np.cos(store.theta[top])
+        store.pos[top, 2] = origin[2] + vortex.sin_amplitude * np.cos(clock * 0.8) + r * np.sin(store.theta[top])
+    return store.pos
+
+
+def warmup():
+    """
+    Compiles (or loads from the cache) every kernel on a tiny store, through
+    the Rankine branch and the lookup table branch. Returns the time it took.
+    """
+    start = time.perf_counter()
+    if numba is not None:
+        a = np.linspace(0.0, 3.0, 8)
+        table = tabulate(RANKINE)
+        kernels = (_advect_serial,) if _advect_parallel is _advect_serial else (_advect_serial, _advect_parallel)
+        for kernel in kernels:
+            for f, step in ((_NO_TABLE, 1.0), (table.tables['f'], table.step)):
+                kernel(a.copy(), a.copy(), a.copy(), np.zeros((8, 3)), a.copy(), np.zeros(8, dtype=np.bool_),
+                       f, step, 0.01, 0.0,
+                       20.0, 0.25, 2.0, 0.6, 7.0, 4.5, 0.5, 2.5, 0.0, 0.0, 0.0)
+    return time.perf_counter() - start
+
+
+def threading_layer():
+    """
+    Threading layer of Numba once the parallel kernel has run ('omp', 'tbb'
+    or 'workqueue'), None before that or when it is the serial kernel.
+    """
+    if numba is None:
+        return None
+    try:
+        return numba.threading_layer()
+    except ValueError:
+        return None
+
+
+def main():
+    from TwisterParticles import ParticleStore
+    start = time.perf_counter()
+    load()
+    print('backend: %s (numba %s)' % (_backend, numba.__version__ if numba is not None else 'not installed'))
+    print('import and warm-up: %.2f s' % (time.perf_counter() - start))
+
+    class _Vortex:
+        height, radius_base, radius_top, core_radius = 20.0, 0.25, 3.0, 1.6
+        omega0, max_inclination, sin_amplitude, sin_freq = 7.0, 10.0, 0.5, 2.5
+
+    for n in (1000, 100000, 1000000):
+        times = {}
+        stores = {}
+        for name in ('numpy', 'numba') if numba is not None else ('numpy',):
+            set_backend(name)
+            store = stores[name] = ParticleStore.funnel(n, 20.0, 0.25, 3.0, rng=np.random.default_rng(0))
+            start = time.perf_counter()
+            for k in range(20):
+                store.advect(1/60, k/60, _Vortex, (0.0, 0.0, 0.0))
+            times[name] = (time.perf_counter() - start) / 20 * 1e3
+        line = '%8d particles: ' % n + ', '.join('%s %.2f ms' % kv for kv in times.items())
+        if len(stores) == 2:
+            line += ', max |dpos| %.1e' % np.abs(stores['numpy'].pos - stores['numba'].pos).max()
+        print(line)
+    if numba is not None:
+        print('threads: %d, threading layer: %s' % (numba.config.NUMBA_NUM_THREADS, threading_layer()))
+
+
+if __name__ == '__main__':
+    main()
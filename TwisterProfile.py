@@ -0,0 +1,301 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Built-in frame profiler of the twister scripts.
+# Simulation.step and the update() of the front-ends time their stages with
+# profiler.stage(name); per-frame counters (tornadoes, particles, entities)
+# are set with count. begin_frame closes the previous frame, so when it is
+# called at the top of update() the frame time includes the rendering.
+# Everything goes into a ring buffer of the last capacity frames
+# (preallocated NumPy arrays, no allocation per frame), which ProfilerOverlay
+# draws on screen and export_chrome_trace writes as a JSON trace for
+# chrome://tracing or https://ui.perfetto.dev.
+# With track_allocations=True, the Python memory allocated during each frame
+# is also recorded (tracemalloc, noticeably slower).
+
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# ----------- Ring Buffer Profiler -----------
+class _Stage:
+    def __init__(self, profiler, column):
+        self.profiler = profiler
+        self.column = column
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        p = self.profiler
+        now = time.perf_counter()
+        row = p.row
+        if p.stage_ms[row, self.column] == 0.0:
+            p.stage_start[row, self.column] = self.start
+        p.stage_ms[row, self.column] += (now - self.start) * 1e3
+        return False
+
+
+class FrameProfiler:
+    """
+    capacity   : frames kept in the ring buffer
+    max_stages : distinct stage names (columns), in order of first use
+    """
+
+    def __init__(self, capacity=600, max_stages=16, max_counters=8, track_allocations=False):
+        self.capacity = capacity
+        self.stage_ms = np.zeros((capacity, max_stages))
+        self.stage_start = np.zeros((capacity, max_stages))
+        self.counters = np.zeros((capacity, max_counters))
+        self.frame_ms = np.zeros(capacity)
+        self.frame_start = np.zeros(capacity)
+        self.alloc_kb = np.zeros(capacity)
+        self.stage_names = []
+        self.counter_names = []
+        self.stages = {}
+        self.row = 0
+        self.frames = 0
+        self.started = None
+        self.track_allocations = track_allocations
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name):
+        s = self.stages.get(name)
+        if s is None:
+            if len(self.stage_names) == self.stage_ms.shape[1]:
+                raise ValueError('more than %d profiler stages' % self.stage_ms.shape[1])
+            self.stage_names.append(name)
+            s = self.stages[name] = _Stage(self, len(self.stage_names) - 1)
+        return s
+
+    def begin_frame(self):
+        if self.started is not None:
+            self.end_frame()
+        self.counters[self.row] = 0.0
+        self.stage_ms[self.row] = 0.0
+        self.started = time.perf_counter()
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+            self.alloc_base = tracemalloc.get_traced_memory()[0]
+
+    def count(self, **counters):
+        # Counters of the current frame (particles=..., entities=...)
+        for name, value in counters.items():
+            if name not in self.counter_names:
+                if len(self.counter_names) == self.counters.shape[1]:
+                    continue
+                self.counter_names.append(name)
+            self.counters[self.row, self.counter_names.index(name)] = value
+
+    def end_frame(self, **counters):
+        if self.started is None:
+            return
+        self.count(**counters)
+        row = self.row
+        now = time.perf_counter()
+        self.frame_start[row] = self.started
+        self.frame_ms[row] = (now - self.started) * 1e3
+        if self.track_allocations:
+            self.alloc_kb[row] = (tracemalloc.get_traced_memory()[1] - self.alloc_base) / 1024
+        self.started = None
+        self.frames += 1
+        self.row = (row + 1) % self.capacity
+
+    def history(self):
+        """
+        Indices of the recorded rows, oldest first.
+        """
+        n = min(self.frames, self.capacity)
+        return (np.arange(n) + self.row - n) % self.capacity
+
+    def summary(self, frames=60):
+        """
+        Mean ms per stage over the last frames, plus the frame time.
+        """
+        rows = self.history()[-frames:]
+        if len(rows) == 0:
+            return {}
+        out = {name: float(self.stage_ms[rows, k].mean()) for k, name in enumerate(self.stage_names)}
+        out['frame'] = float(self.frame_ms[rows].mean())
+        return out
+
+    def export_chrome_trace(self, path):
+        """
+        Chrome trace event format: one complete event per frame (thread 0),
+        one per stage and frame (thread 1, a stage called several times in a
+        frame is one event starting at its first call) and counter tracks.
+        """
+        events = []
+        origin = self.frame_start[self.history()].min() if self.frames else 0.0
+        us = lambda t: (t - origin) * 1e6
+        for row in self.history().tolist():
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                           'ts': us(self.frame_start[row]), 'dur': self.frame_ms[row] * 1e3})
+            for k, name in enumerate(self.stage_names):
+                if self.stage_ms[row, k] > 0:
+                    events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 1,
+                                   'ts': us(self.stage_start[row, k]), 'dur': self.stage_ms[row, k] * 1e3})
+            args = {name: float(self.counters[row, k]) for k, name in enumerate(self.counter_names)}
+            if self.track_allocations:
+                args['alloc_kb'] = float(self.alloc_kb[row])
+            if args:
+                events.append({'name': 'counters', 'ph': 'C', 'pid': 0, 'ts': us(self.frame_start[row]), 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    """
+    Profiler interface doing nothing (Simulation default).
+    """
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def begin_frame(self):
+        pass
+
+    def count(self, **counters):
+        pass
+
+    def end_frame(self, **counters):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+# ----------- Startup Timer -----------
+# Wall clock when this module was imported, the start of the imports when the
+# age of the process is unknown
+_IMPORTED = time.perf_counter()
+
+
+def process_age():
+    """
+    Wall-clock seconds since the process started (interpreter start
+    included): /proc on Linux, psutil elsewhere when installed, else None.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may hold spaces; starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return max(time.time() - psutil.Process().create_time(), 0.0)
+
+
+class StartupTimer:
+    """
+    Phases of a launch up to the first frame on screen, all in wall-clock
+    time. Created right after the imports, which are reported as the age of
+    the process so far (interpreter start included, from the import of this
+    module when the age is unknown); each mark(name) then closes a phase.
+    frame() is called at the top of update(): its second call (the first
+    frame has been drawn) closes the 'first frame' phase, prints the report
+    and returns True.
+    """
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        age = process_age()
+        self.imports_ms = (age if age is not None else self.last - _IMPORTED) * 1e3
+        self.phases = []
+        self.frames = 0
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, (now - self.last) * 1e3))
+        self.last = now
+
+    def frame(self):
+        self.frames += 1
+        if self.frames == 1:
+            self.mark('run')
+        elif self.frames == 2:
+            self.mark('first frame')
+            print(self.report())
+            return True
+        return False
+
+    def total_ms(self):
+        return self.imports_ms + sum(ms for _, ms in self.phases)
+
+    def report(self):
+        lines = ['startup: %.0f ms to the first frame' % self.total_ms(),
+                 '  %-14s %6.0f ms' % ('imports', self.imports_ms)]
+        lines += ['  %-14s %6.0f ms' % phase for phase in self.phases]
+        return '\n'.join(lines)
+
+
+# ----------- On-screen Overlay -----------
+class ProfilerOverlay:
+    """
+    Ursina overlay: mean stage times of the last second as text, and the
+    frame times of the ring buffer as a bar graph (red above budget_ms).
+    """
+
+    def __init__(self, profiler, bars=120, budget_ms=1000/60, refresh_rate=4.0):
+        from ursina import Entity, Text, camera
+        from TwisterRender import QuadBatch
+        self.profiler = profiler
+        self.bars = bars
+        self.budget_ms = budget_ms
+        self.refresh_rate = refresh_rate
+        self.timer = 0.0
+        self.parent = Entity(parent=camera.ui)
+        self.text = Text(parent=self.parent, text='', position=(-0.86, 0.47), scale=0.8)
+        self.graph = QuadBatch(bars, self.parent, name='profiler_bars')
+        self.x = -0.86 + np.arange(bars) * 0.003
+
+    @property
+    def enabled(self):
+        return self.parent.enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self.parent.enabled = value
+
+    def update(self, dt):
+        self.timer += dt
+        if not self.parent.enabled or self.timer < 1.0/self.refresh_rate:
+            return
+        self.timer = 0.0
+        p = self.profiler
+        lines = ['%-11s %6.2f ms' % (name, ms) for name, ms in p.summary(60).items()]
+        rows = p.history()
+        if len(rows):
+            last = rows[-1]
+            lines += ['%-11s %6d' % (name, p.counters[last, k]) for k, name in enumerate(p.counter_names)]
+            if p.track_allocations:
+                lines.append('%-11s %6.0f kB' % ('alloc', p.alloc_kb[last]))
+        self.text.text = '\n'.join(lines)
+        ms = np.zeros(self.bars)
+        recent = p.frame_ms[rows[-self.bars:]]
+        ms[self.bars - len(recent):] = recent
+        h = np.clip(ms / (4 * self.budget_ms), 0.002, 1.0) * 0.2
+        centers = np.column_stack((self.x, 0.05 + h / 2))
+        colors = np.where((ms > self.budget_ms)[:, None], (1.0, 0.2, 0.2, 0.9), (0.2, 1.0, 0.3, 0.9))
+        self.graph.update(centers, np.column_stack((np.full(self.bars, 0.0025), h)), 0.0, colors)
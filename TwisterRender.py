@@ -0,0 +1,508 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Batched renderers for the twister scripts.
+# A PointCloud draws all the particles of a tornado (or all its debris) as a
+# single dynamic Panda3D Geom made of points. Positions, colors and sizes are
+# packed from NumPy arrays into one interleaved float32 buffer and uploaded
+# with a single copy per frame, so the cost no longer depends on the number
+# of scene-graph nodes. Only Panda3D is required: the clouds can be attached
+# to the Ursina scene or to any NodePath of an offscreen/headless ShowBase.
+
+import numpy as np
+from TwisterEngine import BLUE, CYAN
+from TwisterParticles import lerp_colors, palette_colors
+from panda3d.core import (
+    Geom, GeomNode, GeomPoints, GeomTriangles, GeomVertexArrayFormat,
+    GeomVertexData, GeomVertexFormat, OmniBoundingVolume, Shader, TransparencyAttrib,
+    loadPrcFileData,
+)
+
+# Per-vertex point size needs a shader (fixed-function points have a single
+# thickness). gl_PointSize is divided by w so that points shrink with distance.
+_POINT_VERT = """
+#version 120
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform float point_scale;
+attribute vec4 p3d_Vertex;
+attribute vec4 p3d_Color;
+attribute float size;
+varying vec4 v_color;
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    gl_PointSize = point_scale * size / max(gl_Position.w, 1e-3);
+    v_color = p3d_Color;
+}
+"""
+
+_POINT_FRAG = """
+#version 120
+varying vec4 v_color;
+void main() {
+    gl_FragColor = v_color;
+}
+"""
+
+_point_format = None
+_quad_format = None
+
+
+def point_format():
+    """
+    Interleaved vertex format: vertex (3 floats), color (4 floats), size (1 float).
+    """
+    global _point_format
+    if _point_format is None:
+        array = GeomVertexArrayFormat()
+        array.add_column('vertex', 3, Geom.NT_float32, Geom.C_point)
+        array.add_column('color', 4, Geom.NT_float32, Geom.C_color)
+        array.add_column('size', 1, Geom.NT_float32, Geom.C_other)
+        _point_format = GeomVertexFormat.register_format(GeomVertexFormat(array))
+    return _point_format
+
+
+def quad_format():
+    """
+    Interleaved vertex format: vertex (3 floats), color (4 floats).
+    """
+    global _quad_format
+    if _quad_format is None:
+        array = GeomVertexArrayFormat()
+        array.add_column('vertex', 3, Geom.NT_float32, Geom.C_point)
+        array.add_column('color', 4, Geom.NT_float32, Geom.C_color)
+        _quad_format = GeomVertexFormat.register_format(GeomVertexFormat(array))
+    return _quad_format
+
+
+def supports_shaders():
+    import builtins
+    base = getattr(builtins, 'base', None)
+    win = getattr(base, 'win', None)
+    gsg = win.get_gsg() if win is not None else None
+    return gsg is not None and gsg.get_supports_glsl()
+
+
+def open_offscreen(width=640, height=480, software=True):
+    """
+    Starts a ShowBase rendering into an offscreen buffer, for CI machines
+    without a display or GPU (software=True selects Panda's tinydisplay).
+    """
+    prc = 'window-type offscreen\nwin-size %d %d\naudio-library-name null\n' % (width, height)
+    if software:
+        prc += 'load-display p3tinydisplay\n'
+    loadPrcFileData('twister-offscreen', prc)
+    from direct.showbase.ShowBase import ShowBase
+    return ShowBase()
+
+
+# ----------- Point Cloud -----------
+class PointCloud:
+    """
+    One dynamic point mesh fed from NumPy buffers.
+
+    parent      : NodePath to attach to (the Ursina scene by default)
+    thickness   : point size in pixels when shaders are not available
+    point_scale : pixels per world unit at distance 1 (shader path)
+    """
+
+    def __init__(self, capacity=1024, parent=None, thickness=3.0, point_scale=800.0, use_shader=None, name='point_cloud'):
+        if parent is None:
+            from ursina import scene
+            parent = scene
+        self.buffer = np.zeros((max(capacity, 1), 8), dtype=np.float32)
+        self.buffer[:, 3:7] = 1.0
+        self.count = 0
+
+        self.vdata = GeomVertexData(name, point_format(), Geom.UH_dynamic)
+        self.points = GeomPoints(Geom.UH_dynamic)
+        geom = Geom(self.vdata)
+        geom.add_primitive(self.points)
+        node = GeomNode(name)
+        node.add_geom(geom)
+        # The cloud moves every frame: skip bounds recomputation and culling
+        node.set_bounds(OmniBoundingVolume())
+        node.set_final(True)
+
+        self.node_path = parent.attach_new_node(node)
+        self.node_path.set_transparency(TransparencyAttrib.M_alpha)
+        self.node_path.set_depth_write(False)
+        self.node_path.set_light_off()
+        self.node_path.set_render_mode_thickness(thickness)
+        if use_shader is None:
+            use_shader = supports_shaders()
+        if use_shader:
+            self.node_path.set_shader(Shader.make(Shader.SL_GLSL, _POINT_VERT, _POINT_FRAG))
+            self.node_path.set_shader_input('point_scale', point_scale)
+
+    def reserve(self, n):
+        if n > len(self.buffer):
+            grown = np.zeros((max(n, 2 * len(self.buffer)), 8), dtype=np.float32)
+            grown[:, 3:7] = 1.0
+            grown[:len(self.buffer)] = self.buffer
+            self.buffer = grown
+
+    def update(self, positions, colors=None, sizes=None):
+        """
+        Uploads n points. colors is (n, 4) RGBA or a single RGBA, sizes is (n,)
+        or a scalar; both keep their previous value when omitted.
+        """
+        n = len(positions)
+        self.reserve(n)
+        buf = self.buffer[:n]
+        buf[:, 0:3] = positions
+        if colors is not None:
+            buf[:, 3:7] = colors
+        if sizes is not None:
+            buf[:, 7] = sizes
+        self.vdata.modify_array_handle(0).copy_data_from(buf)
+        if n != self.count:
+            self.points.set_nonindexed_vertices(0, n)
+            self.count = n
+
+    def hide(self):
+        self.node_path.hide()
+
+    def show(self):
+        self.node_path.show()
+
+    def destroy(self):
+        self.node_path.remove_node()
+
+
+# ----------- Quad Batch -----------
+class QuadBatch:
+    """
+    A fixed number of flat quads (in the x/y plane of their parent) drawn as
+    one mesh. Centers, sizes, rotations and colors are NumPy arrays; the
+    rotation follows Ursina's rotation_z convention (degrees, clockwise).
+    """
+
+    def __init__(self, n, parent, name='quad_batch'):
+        self.n = n
+        self.buffer = np.zeros((4*n, 7), dtype=np.float32)
+        self.vdata = GeomVertexData(name, quad_format(), Geom.UH_dynamic)
+        self.vdata.unclean_set_num_rows(4*n)
+        quads = 4*np.arange(n, dtype=np.uint32)[:, None]
+        tris = GeomTriangles(Geom.UH_static)
+        tris.set_index_type(Geom.NT_uint32)
+        index = tris.modify_vertices()
+        index.unclean_set_num_rows(6*n)
+        index.modify_handle().copy_data_from((quads + np.array([0, 1, 2, 0, 2, 3], dtype=np.uint32)).ravel())
+        geom = Geom(self.vdata)
+        geom.add_primitive(tris)
+        node = GeomNode(name)
+        node.add_geom(geom)
+        node.set_bounds(OmniBoundingVolume())
+        node.set_final(True)
+        self.node_path = parent.attach_new_node(node)
+        self.node_path.set_two_sided(True)
+        self.node_path.set_light_off()
+        self.node_path.set_depth_test(False)
+        self.node_path.set_depth_write(False)
+        self.node_path.set_bin('fixed', 10)
+
+    def update(self, centers, size, rotation=0.0, colors=None, depth=0.0):
+        centers = np.asarray(centers, dtype=float)
+        size = np.broadcast_to(np.asarray(size, dtype=float), (self.n, 2))
+        a = np.radians(np.broadcast_to(rotation, (self.n,)))
+        cos_a = np.cos(a)[:, None]
+        sin_a = np.sin(a)[:, None]
+        # Corners of the unit quad, scaled then rotated like an Ursina entity
+        corners = np.array([[-0.5, -0.5], [0.5, -0.5], [0.5, 0.5], [-0.5, 0.5]])
+        cx = corners[None, :, 0] * size[:, 0:1]
+        cy = corners[None, :, 1] * size[:, 1:2]
+        buf = self.buffer.reshape(self.n, 4, 7)
+        buf[:, :, 0] = centers[:, 0:1] + cx*cos_a + cy*sin_a
+        buf[:, :, 1] = centers[:, 1:2] - cx*sin_a + cy*cos_a
+        buf[:, :, 2] = depth
+        if colors is not None:
+            buf[:, :, 3:7] = np.broadcast_to(np.asarray(colors, dtype=float), (self.n, 4))[:, None, :]
+        self.vdata.modify_array_handle(0).copy_data_from(self.buffer)
+
+    def destroy(self):
+        self.node_path.remove_node()
+
+
+class EntityCloud:
+    """
+    Legacy renderer with one Ursina sphere Entity per point. Same interface as
+    PointCloud (render_mode = 'entities' in the scripts). At most
+    builds_per_frame entities are created per update, so the thousands of
+    spheres of a funnel appear over the first frames instead of delaying the
+    first one; until then only the first points are drawn.
+    """
+
+    def __init__(self, capacity=0, parent=None, model='sphere', builds_per_frame=100, **kwargs):
+        self.entities = []
+        self.model = model
+        self.parent = parent
+        self.builds_per_frame = builds_per_frame
+
+    def update(self, positions, colors=None, sizes=None):
+        from ursina import Entity, scene, destroy
+        n = len(positions)
+        for _ in range(min(n - len(self.entities), self.builds_per_frame)):
+            self.entities.append(Entity(parent=self.parent if self.parent is not None else scene, model=self.model))
+        while len(self.entities) > n:
+            destroy(self.entities.pop())
+        # zip stops at the entities built so far
+        if colors is not None:
+            colors = np.broadcast_to(colors, (n, 4))
+            for ent, c in zip(self.entities, colors.tolist()):
+                ent.color = c
+        if sizes is not None:
+            sizes = np.broadcast_to(sizes, (n,))
+            for ent, s in zip(self.entities, sizes.tolist()):
+                ent.scale = s
+        for ent, p in zip(self.entities, positions.tolist()):
+            ent.position = p
+
+    def hide(self):
+        for ent in self.entities:
+            ent.enabled = False
+
+    def show(self):
+        for ent in self.entities:
+            ent.enabled = True
+
+    def destroy(self):
+        from ursina import destroy
+        for ent in self.entities:
+            destroy(ent)
+        self.entities.clear()
+
+
+def make_cloud(render_mode, capacity, **kwargs):
+    """
+    render_mode: 'points' (one batched mesh) or 'entities' (one Entity per point).
+    """
+    if render_mode == 'entities':
+        return EntityCloud(capacity, **kwargs)
+    return PointCloud(capacity, **kwargs)
+
+
+# ----------- Scene Adapter -----------
+def particle_style(t, index=None):
+    """
+    Colors (n, 4) and sizes (n,) of the particles of a TwisterEngine.Vortex,
+    following its color_mode, size_range and alpha_range (only the particles
+    of index when given).
+    """
+    p = t.particles
+    z, col = (p.z, p.col) if index is None else (p.z[index], p.col[index])
+    frac = z / t.height
+    if t.color_mode == 'speed':
+        # Color gradient: higher velocity = deeper blue
+        speed = p.speed if index is None else p.speed[index]
+        cols = lerp_colors(CYAN, BLUE, np.clip(speed / t.v_tot_max, 0, 1))
+    elif t.color_mode == 'gradient':
+        # Even particles go from the base to the top color with altitude, odd ones the other way
+        cols = lerp_colors(t.palette[0], t.palette[-1], np.where(col == 0, frac, 1 - frac))
+    else:
+        cols = palette_colors(t.palette, col)
+    a0, a1 = t.alpha_range
+    s0, s1 = t.size_range
+    cols[:, 3] = a0 + (a1 - a0) * frac
+    return cols, s0 + (s1 - s0) * frac
+
+
+def terrain_model(terrain, mode='line'):
+    """
+    Ursina Mesh of a TwisterEngine.Terrain.
+    """
+    return mesh_model(*terrain.mesh_arrays(), mode=mode)
+
+
+def mesh_model(vertices, triangles, uvs, mode='line'):
+    from ursina import Mesh
+    return Mesh(vertices=vertices.tolist(), triangles=triangles.tolist(), uvs=uvs.tolist(), mode=mode)
+
+
+class TerrainStreamer:
+    """
+    Chunks of a TwisterEngine.ChunkedTerrain loaded around focus points (the
+    tornadoes, the camera). Each update asks the terrain which chunks are
+    visible and at which LOD, destroys the chunks that left the view and
+    (re)builds the missing ones, nearest first, at most builds_per_frame per
+    call so that moving fast never stalls a frame. Returns the number of
+    chunks still waiting to be built. Chunks of different LOD
+    meet with small cracks, invisible in the default 'line' mode.
+    """
+
+    def __init__(self, terrain, parent=None, mode='line', color=None, builds_per_frame=8):
+        self.terrain = terrain
+        self.parent = parent
+        self.mode = mode
+        self.color = color
+        self.builds_per_frame = builds_per_frame
+        self.chunks = {}
+
+    def update(self, points):
+        from ursina import Entity, color, destroy, scene
+        wanted = self.terrain.visible_chunks(points)
+        for key in list(self.chunks):
+            if key not in wanted:
+                destroy(self.chunks.pop(key)[1])
+        # Coarse LODs are the far chunks: build the fine, near ones first
+        pending = sorted((lod, key) for key, lod in wanted.items()
+                         if key not in self.chunks or self.chunks[key][0] != lod)
+        for lod, key in pending[:self.builds_per_frame]:
+            old = self.chunks.pop(key, None)
+            if old is not None:
+                destroy(old[1])
+            ox, oz = self.terrain.chunk_origin(*key)
+            entity = Entity(parent=self.parent if self.parent is not None else scene,
+                            model=mesh_model(*self.terrain.chunk_arrays(*key, lod), mode=self.mode),
+                            position=(ox, 0, oz),
+                            color=self.color if self.color is not None else color.gray)
+            self.chunks[key] = (lod, entity)
+        return max(0, len(pending) - self.builds_per_frame)
+
+    def destroy(self):
+        from ursina import destroy
+        for _, entity in self.chunks.values():
+            destroy(entity)
+        self.chunks = {}
+
+
+class SceneView:
+    """
+    Thin render adapter of a Simulation: one particle cloud (and one debris
+    cloud) per tornado. The clouds of tornadoes that vanish in a step (a
+    fusion) are handed over to the tornadoes that appear in the same step,
+    so a fusion frame allocates no render resources. drawn counts the
+    particles uploaded by the last sync.
+    """
+
+    def __init__(self, render_mode='points', parent=None):
+        self.render_mode = render_mode
+        self.parent = parent
+        self.views = {}
+        self.hidden = set()
+        self.drawn = 0
+
+    def set_visible(self, key, clouds, visible):
+        # show()/hide() only on changes (EntityCloud walks all its entities)
+        if visible == (key not in self.hidden):
+            return
+        for cloud in clouds:
+            if cloud is None:
+                continue
+            if visible:
+                cloud.show()
+            else:
+                cloud.hide()
+        if visible:
+            self.hidden.discard(key)
+        else:
+            self.hidden.add(key)
+
+    def sync(self, tornadoes, stepper=None, lod=None):
+        # stepper: TwisterEngine.FixedStepper to draw positions interpolated
+        # between the last two physics steps
+        # lod: TwisterCulling.ParticleLOD updated for this frame; culled
+        # tornadoes are hidden, the others draw the particles it selects
+        current = {id(t) for t in tornadoes}
+        freed = []
+        for key in list(self.views):
+            if key not in current:
+                clouds = self.views.pop(key)[1:]
+                self.set_visible(key, clouds, True)
+                freed.append(clouds)
+        self.drawn = 0
+        for t in tornadoes:
+            view = self.views.get(id(t))
+            if view is None:
+                cloud, debris_cloud = freed.pop() if freed else (None, None)
+                if cloud is None:
+                    cloud = make_cloud(self.render_mode, t.n_particles, parent=self.parent)
+                if t.n_debris and debris_cloud is None:
+                    debris_cloud = make_cloud(self.render_mode, t.n_debris, parent=self.parent)
+                elif not t.n_debris and debris_cloud is not None:
+                    debris_cloud.destroy()
+                    debris_cloud = None
+                view = self.views[id(t)] = (t, cloud, debris_cloud)
+            _, cloud, debris_cloud = view
+            plan = (0, None) if lod is None else lod.plan(t)
+            self.set_visible(id(t), (cloud, debris_cloud), plan is not None)
+            if plan is None:
+                continue
+            level, bands = plan
+            index = None if lod is None else lod.index(t, level, bands)
+            cols, sizes = particle_style(t, index)
+            if level:
+                sizes *= lod.size_scale(level)
+            if stepper is not None:
+                positions = stepper.particle_positions(t, index)
+            else:
+                positions = t.particles.pos if index is None else t.particles.pos[index]
+            cloud.update(positions, cols, sizes)
+            self.drawn += len(positions)
+            if debris_cloud is not None:
+                cols, sizes = t.debris.style()
+                debris_cloud.update(t.debris_pos if stepper is None else stepper.debris_positions(t), cols, sizes)
+        for cloud, debris_cloud in freed:
+            cloud.destroy()
+            if debris_cloud is not None:
+                debris_cloud.destroy()
+
+
+# ----------- Wind Mini-map -----------
+class MiniMap:
+    """
+    Wind mini-map overlay. The arrow grid is one QuadBatch created once; each
+    refresh evaluates the wind of all tornadoes on the whole grid in one NumPy
+    broadcast (Simulation.wind_at) and only rewrites arrow orientations and
+    colors. refresh_rate (Hz) may be lower than the frame rate; the tornado
+    markers follow the tornadoes every frame.
+
+    thresholds: wind speeds separating green, yellow and red arrows
+    """
+
+    def __init__(self, extent, grid_step=2.0, thresholds=(10.0, 25.0), refresh_rate=10.0):
+        from ursina import Entity, camera, color
+        self.extent = extent
+        self.thresholds = thresholds
+        self.refresh_rate = refresh_rate
+        self.timer = None
+        self.dpx = 0.254
+        self.dpy = 0.225
+
+        # Overlay mini-map parent (UI)
+        self.parent = Entity(parent=camera.ui, enabled=True)
+        self.bg = Entity(parent=self.parent, model='quad', scale=(0.92,0.92), position=(0.68,0.68,0), color=color.rgba(0,0,0,0.5), eternal=True)
+
+        grid = np.arange(2, extent-2, grid_step)
+        gx, gz = np.meshgrid(grid, grid, indexing='ij')
+        self.gx = gx.ravel()
+        self.gz = gz.ravel()
+        self.centers = np.column_stack(self.map_coords(self.gx, self.gz))
+        self.palette = np.array([tuple(color.green), tuple(color.yellow), tuple(color.red)])
+
+        self.dots = QuadBatch(len(self.gx), self.parent, name='mini_map_dots')
+        self.dots.update(self.centers, (0.002, 0.002), 0.0, self.palette[0], depth=-0.01)
+        self.arrows = QuadBatch(len(self.gx), self.parent, name='mini_map_arrows')
+        self.markers = []
+
+    def map_coords(self, x, z):
+        return (x/self.extent) * 0.28 + self.dpx, (z/self.extent) * 0.28 + self.dpy
+
+    def update(self, sim, dt):
+        from ursina import Entity, color
+        ts = sim.tornadoes
+        while len(self.markers) < len(ts):
+            self.markers.append(Entity(parent=self.parent, model='circle', scale=0.018, color=color.red))
+        for i, marker in enumerate(self.markers):
+            marker.enabled = i < len(ts)
+            if marker.enabled:
+                px, pz = self.map_coords(ts[i].x, ts[i].z)
+                marker.position = (px, pz, -0.01)
+
+        if self.timer is not None and self.timer + dt < 1.0/self.refresh_rate:
+            self.timer += dt
+            return
+        self.timer = 0.0
+        wind = sim.wind_at(self.gx, self.gz)
+        norm = np.hypot(wind[:, 0], wind[:, 1])
+        angle = np.where(norm < 1e-3, 0.0, np.degrees(np.arctan2(wind[:, 0], wind[:, 1])))
+        level = np.searchsorted(self.thresholds, norm, side='right')
+        self.arrows.update(self.centers, (0.003, 0.009), -angle, self.palette[level], depth=-0.01)
@@ -0,0 +1,223 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Parameter sweeps of the headless scenarios (see TwisterEngine.py).
+# A sweep is a list of runs, each one a scenario with some tornado or fusion
+# parameters overridden, run for a fixed number of steps in a process pool.
+# Every parameter point is run with the same seeds (--replicates of them), so
+# the differences between points are the effect of the parameters and the
+# spread over the replicates is the noise. Every finished run appends one row
+# of summary metrics to a CSV table, so an interrupted sweep started again
+# with the same arguments only runs what is missing (failed runs included).
+#
+#   Grid (every combination):
+#   python TwisterSweep.py --out sweep.csv omega0=5,7,9 core_radius=0.6,1.0
+#   Latin hypercube (n runs, ranges lo:hi):
+#   python TwisterSweep.py --out lhs.csv --lhs 64 omega0=4:16 fusion.radius_top=0.5:0.9
+#
+# Parameter names: 'omega0' is an argument of the constructor of every tornado
+# (Vortex, or Vortex.from_intensity in the AI scenarios, e.g. 'intensity'),
+# which is built again with it (Vortex.rebuilt), 't2.omega0' only of the
+# second one, 'fusion.radius_top' overrides a FUSION_WEIGHTS entry.
+# The default number of steps covers the progressive fusion of the 'fusion'
+# scenario (fusion_duration plus the approach).
+
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from TwisterEngine import SCENARIOS
+
+METRICS = ['time_to_fusion', 'final_intensity', 'peak_wind', 'particles', 'elapsed']
+
+# Simulated time before a progressive fusion starts (approach of the tornadoes)
+FUSION_APPROACH = 30.0
+
+
+# ----------- Sweep Design -----------
+def parse_spec(items):
+    """
+    'name=v1,v2,...' (grid values) or 'name=lo:hi' (Latin hypercube range).
+    """
+    spec = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        if ':' in values:
+            lo, hi = values.split(':')
+            spec[name] = (float(lo), float(hi))
+        else:
+            spec[name] = [float(v) for v in values.split(',')]
+    return spec
+
+
+def grid(spec):
+    names = list(spec)
+    return [dict(zip(names, values)) for values in itertools.product(*(spec[n] for n in names))]
+
+
+def latin_hypercube(spec, n, rng):
+    """
+    n runs; the range of every parameter is cut in n strata and each stratum
+    is used exactly once, in an independent random order per parameter.
+    """
+    runs = [{} for _ in range(n)]
+    for name, (lo, hi) in spec.items():
+        u = (rng.permutation(n) + rng.uniform(0, 1, n)) / n
+        for run, v in zip(runs, lo + (hi - lo) * u):
+            run[name] = float(v)
+    return runs
+
+
+# ----------- Single Run -----------
+def apply_params(sim, params):
+    weights = {}
+    overrides = [{} for _ in sim.tornadoes]
+    for name, value in params.items():
+        if name.startswith('fusion.'):
+            weights[name[len('fusion.'):]] = value
+        elif name.startswith('t') and '.' in name:
+            index, attr = name[1:].split('.', 1)
+            overrides[int(index)-1][attr] = value
+        else:
+            for o in overrides:
+                o[name] = value
+    ts = sim.tornadoes
+    ts[:] = [t.rebuilt(**o) if o else t for t, o in zip(ts, overrides)]
+    if weights:
+        sim.fusion_weights = weights
+
+
+def default_steps(scenario, dt):
+    # Long enough for a progressive fusion to complete, 2000 steps otherwise
+    sim = SCENARIOS[scenario](0)
+    if sim.fusion == 'blend':
+        return int(np.ceil((sim.fusion_duration + FUSION_APPROACH) / dt))
+    return 2000
+
+
+def run_one(scenario, params, seed, steps, dt, probe_every=10, probe_step=2.0):
+    """
+    Runs one scenario and returns its summary metrics:
+    time_to_fusion  simulated time of the first fusion (nan if none)
+    final_intensity largest tornado intensity at the end
+    peak_wind       largest wind speed seen on a probe grid (every probe_every steps)
+    particles       particle count at the end
+    """
+    start = time.perf_counter()
+    sim = SCENARIOS[scenario](seed)
+    apply_params(sim, params)
+    e = sim.terrain.extent
+    gx, gz = np.meshgrid(np.arange(0, e, probe_step), np.arange(0, e, probe_step), indexing='ij')
+    time_to_fusion = float('nan')
+    peak_wind = 0.0
+    for k in range(steps):
+        sim.step(dt)
+        if sim.state.fusions and np.isnan(time_to_fusion):
+            time_to_fusion = sim.state.time
+        if k % probe_every == 0:
+            peak_wind = max(peak_wind, float(np.linalg.norm(sim.wind_at(gx, gz), axis=-1).max()))
+    ts = sim.tornadoes
+    return {
+        'time_to_fusion': time_to_fusion,
+        'final_intensity': max([t.intensity for t in ts]) if ts else 0.0,
+        'peak_wind': peak_wind,
+        'particles': sum(t.n_particles for t in ts),
+        'elapsed': time.perf_counter() - start,
+    }
+
+
+# ----------- Ensemble -----------
+def finished_runs(path):
+    # Runs with an 'ok' row. Failed runs are run again: their rows are dropped
+    # from the file (rewritten, then swapped in) so that every run keeps one row
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    ok = [row for row in rows if row.get('status', 'ok') == 'ok']
+    if len(ok) < len(rows):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            writer.writerows(ok)
+        os.replace(tmp, path)
+    return {int(row['run']) for row in ok}
+
+
+def sweep(runs, out, scenario='fusion', steps=None, dt=1/60, seed=0, workers=None, replicates=1):
+    """
+    Runs every parameter set of runs (list of dicts) with the seeds seed,
+    ..., seed + replicates - 1 in a process pool and appends one CSV row per
+    finished run to out. Run k is point k // replicates with seed
+    seed + k % replicates, so a resumed sweep skips the rows already in out
+    and reproduces the others. A run that raises is written with status
+    'failed: <error>' and metrics nan; on resume its row is removed and the
+    run is done again.
+    steps=None: default_steps of the scenario.
+    """
+    if steps is None:
+        steps = default_steps(scenario, dt)
+    names = sorted({name for params in runs for name in params})
+    done = finished_runs(out)
+    total = len(runs) * replicates
+    todo = [k for k in range(total) if k not in done]
+    print('%d runs (%d points x %d seeds, %d steps), %d already in %s, %d to do'
+          % (total, len(runs), replicates, steps, len(done), out, len(todo)))
+    new_file = not os.path.exists(out)
+    failed = 0
+    with open(out, 'a', newline='') as f, ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        writer = csv.DictWriter(f, fieldnames=['run', 'point', 'seed'] + names + METRICS + ['status'])
+        if new_file:
+            writer.writeheader()
+        futures = {pool.submit(run_one, scenario, runs[k // replicates], seed + k % replicates, steps, dt): k
+                   for k in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            k = futures[future]
+            row = dict(run=k, point=k // replicates, seed=seed + k % replicates, **runs[k // replicates])
+            try:
+                row.update(future.result(), status='ok')
+            except Exception as exc:
+                failed += 1
+                row.update({m: float('nan') for m in METRICS}, status='failed: %s: %s' % (type(exc).__name__, exc))
+                print('[%d/%d] run %d %s' % (n, len(todo), k, row['status']))
+            writer.writerow(row)
+            f.flush()
+            if row['status'] == 'ok':
+                print('[%d/%d] run %d: fusion at %.1f s, intensity %.2f, peak wind %.1f, %d particles'
+                      % (n, len(todo), k, row['time_to_fusion'], row['final_intensity'],
+                         row['peak_wind'], row['particles']))
+    if failed:
+        print('%d runs failed, run the same command again to retry them' % failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parameter sweep of a headless twister scenario.')
+    parser.add_argument('params', nargs='+', help="name=v1,v2,... (grid) or name=lo:hi (with --lhs)")
+    parser.add_argument('--out', default='sweep.csv')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='fusion')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='steps per run (default: enough for the fusion of the scenario, 2000 otherwise)')
+    parser.add_argument('--dt', type=float, default=1/60)
+    parser.add_argument('--lhs', type=int, default=0, help='number of Latin hypercube runs (0: grid)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replicates', type=int, default=1, help='seeds per parameter point (the same for all)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    spec = parse_spec(args.params)
+    if any(isinstance(v, tuple) != bool(args.lhs) for v in spec.values()):
+        parser.error('use name=lo:hi ranges with --lhs and name=v1,v2,... lists without it')
+    if args.lhs:
+        runs = latin_hypercube(spec, args.lhs, np.random.default_rng(args.seed))
+    else:
+        runs = grid(spec)
+    sweep(runs, args.out, args.scenario, args.steps, args.dt, args.seed, args.workers, args.replicates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Streaming capture of simulation trajectories.
+# A TraceWriter copies the state of every step (particle positions,
+# velocities and speeds, tornado centers, atmosphere pressure, temperature
+# and wind) into a preallocated chunk of chunk_steps rows. Full chunks are
+# written as plain .npy files by a background thread, so the simulation loop
+# never waits for the disk unless all max_chunks buffers are waiting to be
+# written (bounded memory). meta.json is rewritten after every chunk, so the
+# chunks of an interrupted run stay readable. A
+# TraceReader memory-maps only the chunks that cover the requested steps and
+# slices particles or tornadoes without loading the rest of the run.
+#
+#   python TwisterTrace.py --scenario fusion --steps 20000 --out fusion_run
+#
+# Layout of the output directory:
+#   meta.json                 fields, shapes, dtypes and rows of every written chunk
+#   <field>_<chunk>.npy       (rows,) + shape of the field
+# Particles of all tornadoes are stored one after the other in tornado order,
+# padded with NaN up to max_particles (their order changes on fusion).
+# speeds are those computed by the particle engine (ParticleStore.speed);
+# velocities are finite differences of the positions, NaN on the first step,
+# across fusions and for the particles that respawned at the ground.
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from TwisterEngine import SCENARIOS
+
+
+# ----------- Writer -----------
+class TraceWriter:
+    """
+    max_particles, max_tornadoes: fixed widths of the per-step rows
+    chunk_steps : steps per chunk file
+    max_chunks  : chunk buffers in memory (one being filled, the others
+                  waiting for the writer thread)
+    """
+
+    def __init__(self, path, sim, max_particles=None, max_tornadoes=None, chunk_steps=256, max_chunks=4):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        ts = sim.tornadoes
+        if max_particles is None:
+            max_particles = sum(t.n_particles for t in ts)
+        if max_tornadoes is None:
+            max_tornadoes = len(ts)
+        self.fields = {
+            'time': ((), np.float64),
+            'centers': ((max_tornadoes, 3), np.float32),
+            'positions': ((max_particles, 3), np.float32),
+            'velocities': ((max_particles, 3), np.float32),
+            'speeds': ((max_particles,), np.float32),
+        }
+        if sim.atmosphere is not None:
+            for name in ('pressure', 'temperature', 'wind'):
+                self.fields[name] = (getattr(sim.atmosphere, name).shape, np.float32)
+        self.chunk_steps = chunk_steps
+        self.free = queue.Queue()
+        for _ in range(max_chunks):
+            self.free.put({name: np.empty((chunk_steps,) + shape, dtype) for name, (shape, dtype) in self.fields.items()})
+        self.pending = queue.Queue()
+        self.chunks = []
+        self.buffer = self.free.get()
+        self.row = 0
+        self.prev = None
+        self.prev_z = np.full(max_particles, np.nan)
+        self.z = np.full(max_particles, np.nan)
+        self.prev_time = None
+        self.prev_layout = None
+        self.wait_time = 0.0
+        self.error = None
+        self.written = []
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def capture(self, sim):
+        if self.error is not None:
+            raise self.error
+        s = sim.state
+        b = self.buffer
+        k = self.row
+        b['time'][k] = s.time
+        centers = b['centers'][k]
+        centers[:] = np.nan
+        n_t = min(len(s.tornadoes), len(centers))
+        centers[:n_t] = [t.position for t in s.tornadoes[:n_t]]
+        pos = b['positions'][k]
+        speed = b['speeds'][k]
+        pos[:] = np.nan
+        speed[:] = np.nan
+        self.prev_z, self.z = self.z, self.prev_z
+        z = self.z
+        z[:] = np.nan
+        start = 0
+        for t in s.tornadoes:
+            n = min(t.n_particles, len(pos) - start)
+            pos[start:start+n] = t.particles.pos[:n]
+            speed[start:start+n] = t.particles.speed[:n]
+            z[start:start+n] = t.particles.z[:n]
+            start += n
+        # Finite differences, undefined on the first step, across fusions and
+        # for respawned particles (their altitude above the base dropped)
+        layout = [id(t) for t in s.tornadoes]
+        vel = b['velocities'][k]
+        if self.prev is not None and layout == self.prev_layout and s.time > self.prev_time:
+            np.subtract(pos, self.prev, out=vel)
+            vel /= s.time - self.prev_time
+            vel[z < self.prev_z] = np.nan
+        else:
+            vel[:] = np.nan
+        self.prev = pos
+        self.prev_time = s.time
+        self.prev_layout = layout
+        if sim.atmosphere is not None:
+            for name in ('pressure', 'temperature', 'wind'):
+                b[name][k] = getattr(sim.atmosphere, name)
+        self.row += 1
+        if self.row == self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        if self.row == 0:
+            return
+        # The previous row must outlive the buffer handed to the writer thread
+        self.prev = self.prev.copy()
+        self.pending.put((len(self.chunks), self.buffer, self.row))
+        self.chunks.append(self.row)
+        # Only waits when every buffer is queued for writing (disk slower than the simulation)
+        start = time.perf_counter()
+        self.buffer = self.free.get()
+        self.wait_time += time.perf_counter() - start
+        self.row = 0
+
+    def write_loop(self):
+        # After an error the chunks are dropped (the buffers still go back,
+        # capture never blocks) and capture/close raise it
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            index, buffer, rows = item
+            try:
+                if self.error is None:
+                    for name, data in buffer.items():
+                        np.save(os.path.join(self.path, '%s_%05d.npy' % (name, index)), data[:rows])
+                    self.written.append(rows)
+                    self.write_meta()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(buffer)
+
+    def write_meta(self):
+        # Replaced in one rename: a reader never sees a partial file
+        meta = {
+            'chunks': self.written,
+            'fields': {name: {'shape': list(shape), 'dtype': np.dtype(dtype).str}
+                       for name, (shape, dtype) in self.fields.items()},
+        }
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        if self.error is None:
+            self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        if not self.written:
+            self.write_meta()
+
+
+# ----------- Reader -----------
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.fields = list(meta['fields'])
+        self.field_meta = meta['fields']
+        self.chunk_rows = meta['chunks']
+        self.starts = np.concatenate(([0], np.cumsum(self.chunk_rows)))
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def chunk(self, name, index):
+        return np.load(os.path.join(self.path, '%s_%05d.npy' % (name, index)), mmap_mode='r')
+
+    def read(self, name, start=0, stop=None, index=None):
+        """
+        Rows [start, stop) of a field; index (int, slice or array) selects
+        particles / tornadoes / grid rows. Only the chunks that overlap the
+        range are opened, as memory maps.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        parts = []
+        first = max(int(np.searchsorted(self.starts, start, side='right')) - 1, 0)
+        for c in range(first, len(self.chunk_rows)):
+            lo, hi = self.starts[c], self.starts[c+1]
+            if lo >= stop:
+                break
+            data = self.chunk(name, c)[max(start, lo) - lo:min(stop, hi) - lo]
+            parts.append(data if index is None else data[:, index])
+        if not parts:
+            field = self.field_meta[name]
+            return np.zeros((0,) + tuple(field['shape']), dtype=field['dtype'])
+        return np.concatenate(parts)
+
+    def times(self):
+        return self.read('time')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a scenario headless and stream its trajectory to disk.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='fusion')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--dt', type=float, default=1/60)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default='trace')
+    parser.add_argument('--chunk-steps', type=int, default=256)
+    args = parser.parse_args()
+
+    sim = SCENARIOS[args.scenario](args.seed)
+    writer = TraceWriter(args.out, sim, chunk_steps=args.chunk_steps)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        sim.step(args.dt)
+        writer.capture(sim)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print('%d steps in %.2f s, %.3f s waiting for the disk, %d chunks in %s'
+          % (args.steps, elapsed, writer.wait_time, len(writer.chunks), args.out))
+
+
+if __name__ == '__main__':
+    main()
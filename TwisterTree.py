@@ -0,0 +1,217 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Barnes-Hut evaluation of the wind induced by many vortices.
+# Summing every tornado at every point (TwisterEngine.wind_field) costs
+# O(vortices * points). A VortexTree sorts the vortices in a quadtree (Morton
+# order) and stores, for every cell, the multipole expansion of its point
+# vortices about the cell center, in complex notation (zeta = x + i z):
+#
+#   sum_k G_k / (zeta - zeta_k) = sum_p a_p / (zeta - c)**(p+1),
+#   a_p = sum_k G_k (zeta_k - c)**p,  G_k = 2*pi*omega0*core_radius**2
+#
+# A cell of half-diagonal s seen from a distance d is evaluated through its
+# expansion when s < theta * d (error of order (s/d)**order) and every vortex
+# of the cell is farther than the far_radius of its profile (in core radii),
+# where the profiles of TwisterVortex reduce to a point vortex. Other cells
+# are opened; the leaves that remain are summed directly with the exact
+# profiles. theta = 0
+# gives the direct sum, larger values are faster and less accurate; the cost
+# is about O(points * log(vortices)).
+#
+# The traversal is vectorized over (target, cell) pairs, one tree level per
+# iteration, so there is no Python loop over the targets.
+
+import numpy as np
+from TwisterVortex import get_profile
+
+
+def _spread_bits(v):
+    # 16-bit integers -> even bits of a 32-bit Morton code
+    v = v.astype(np.int64) & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def _ranges(starts, counts):
+    # Concatenation of arange(start, start + count) for every pair
+    total = int(counts.sum())
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(total) - offsets
+
+
+# ----------- Vortex Tree -----------
+class VortexTree:
+    """
+    x, z, core_radius, omega0, strain: arrays, one entry per vortex
+    profiles : one VortexProfile per vortex (or a single one for all)
+    theta    : opening criterion (0: exact direct sum)
+    order    : terms of the multipole expansions
+    leaf_size: vortices per leaf cell
+    """
+
+    def __init__(self, x, z, core_radius, omega0, strain=0.0, profiles=None, theta=0.5, order=8,
+                 leaf_size=16, max_depth=16):
+        x = np.asarray(x, dtype=float).ravel()
+        z = np.asarray(z, dtype=float).ravel()
+        n = len(x)
+        core_radius = np.broadcast_to(np.asarray(core_radius, dtype=float), (n,))
+        omega0 = np.broadcast_to(np.asarray(omega0, dtype=float), (n,))
+        strain = np.broadcast_to(np.asarray(strain, dtype=float), (n,))
+        if profiles is None or not isinstance(profiles, (list, tuple)):
+            profiles = [get_profile(profiles or 'rankine')] * n
+        self.theta = theta
+        self.order = order
+        self.leaf_size = leaf_size
+        self.profiles = list(dict.fromkeys(profiles))
+        profile_id = np.array([self.profiles.index(p) for p in profiles], dtype=np.intp)
+        if n == 0:
+            self.n_nodes = 0
+            return
+
+        # Morton order of the vortices in the bounding square
+        x0, z0 = x.min(), z.min()
+        side = max(x.max() - x0, z.max() - z0, 1e-9) * (1 + 1e-9)
+        cells = 1 << max_depth
+        ix = np.minimum(((x - x0) / side * cells).astype(np.int64), cells - 1)
+        iz = np.minimum(((z - z0) / side * cells).astype(np.int64), cells - 1)
+        code = _spread_bits(ix) | (_spread_bits(iz) << 1)
+        perm = np.argsort(code, kind='stable')
+        code, ix, iz = code[perm], ix[perm], iz[perm]
+        self.zeta = (x + 1j*z)[perm]
+        self.core_radius = core_radius[perm]
+        self.omega0 = omega0[perm]
+        self.strain = strain[perm]
+        self.profile_id = profile_id[perm]
+        gamma = 2*np.pi * self.omega0 * self.core_radius**2
+        reach = self.core_radius * np.array([p.far_radius for p in self.profiles])[self.profile_id]
+
+        # Cells level by level: contiguous runs of the Morton code prefix
+        starts, ends, centers, half, max_reach, leaf, keys_by_level = [], [], [], [], [], [], []
+        for level in range(max_depth + 1):
+            key = code >> (2 * (max_depth - level))
+            first = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+            keys = key[first]
+            size = side / (1 << level)
+            cx = x0 + (ix[first] // (cells >> level) + 0.5) * size
+            cz = z0 + (iz[first] // (cells >> level) + 0.5) * size
+            count = np.diff(np.concatenate((first, [n])))
+            starts.append(first)
+            ends.append(first + count)
+            centers.append(cx + 1j*cz)
+            half.append(np.full(len(first), size * np.sqrt(0.5)))
+            max_reach.append(np.maximum.reduceat(reach, first))
+            leaf.append((count <= leaf_size) | (level == max_depth))
+            keys_by_level.append(keys)
+            if count.max() <= leaf_size:
+                break
+        offsets = np.cumsum([0] + [len(s) for s in starts])
+        self.n_nodes = int(offsets[-1])
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.center = np.concatenate(centers)
+        self.half = np.concatenate(half)
+        self.max_reach = np.concatenate(max_reach)
+        self.leaf = np.concatenate(leaf)
+        # Children of a cell: the cells of the next level with the same key prefix
+        self.child_start = np.zeros(self.n_nodes, dtype=np.intp)
+        self.child_count = np.zeros(self.n_nodes, dtype=np.intp)
+        for level in range(len(starts) - 1):
+            parent = keys_by_level[level]
+            child = keys_by_level[level + 1] >> 2
+            lo = np.searchsorted(child, parent, side='left')
+            hi = np.searchsorted(child, parent, side='right')
+            sl = slice(offsets[level], offsets[level + 1])
+            self.child_start[sl] = offsets[level + 1] + lo
+            self.child_count[sl] = hi - lo
+
+        # Multipole coefficients a_p of every cell about its center
+        self.coeffs = np.zeros((self.n_nodes, order), dtype=complex)
+        for level in range(len(starts)):
+            first = starts[level]
+            count = ends[level] - first
+            node = np.repeat(np.arange(len(first)), count)
+            d = self.zeta - centers[level][node]
+            term = gamma.astype(complex)
+            for p in range(order):
+                self.coeffs[offsets[level]:offsets[level + 1], p] = np.add.reduceat(term, first)
+                term = term * d
+
+    @classmethod
+    def from_tornadoes(cls, tornadoes, law=None, **kwargs):
+        return cls([t.x for t in tornadoes], [t.z for t in tornadoes],
+                   [t.core_radius for t in tornadoes], [t.omega0 for t in tornadoes],
+                   [t.strain for t in tornadoes],
+                   [get_profile(law) if law is not None else t.profile for t in tornadoes], **kwargs)
+
+    # ----------- Evaluation -----------
+    def velocity(self, x, z):
+        """
+        Horizontal wind (without the tornado drift) induced at the points
+        (x, z), any array shape; returns x.shape + (2,) like wind_field.
+        Points closer than 1e-2 to a vortex get no contribution from it.
+        """
+        x, z = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(z, dtype=float))
+        shape = x.shape
+        targets = (x + 1j*z).ravel()
+        m = len(targets)
+        out = np.zeros(m, dtype=complex)
+        if self.n_nodes and m:
+            t_idx = np.arange(m)
+            n_idx = np.zeros(m, dtype=np.intp)
+            while len(t_idx):
+                rel = targets[t_idx] - self.center[n_idx]
+                d = np.abs(rel)
+                s = self.half[n_idx]
+                far = (s < self.theta * d) & (d - s > self.max_reach[n_idx])
+                if far.any():
+                    self.add_far(out, t_idx[far], n_idx[far], rel[far])
+                near = ~far
+                leaf = near & self.leaf[n_idx]
+                if leaf.any():
+                    self.add_direct(out, targets, t_idx[leaf], n_idx[leaf])
+                inner = near & ~self.leaf[n_idx]
+                counts = self.child_count[n_idx[inner]]
+                t_idx = np.repeat(t_idx[inner], counts)
+                n_idx = _ranges(self.child_start[n_idx[inner]], counts)
+        result = np.empty(shape + (2,))
+        result[..., 0] = out.real.reshape(shape)
+        result[..., 1] = out.imag.reshape(shape)
+        return result
+
+    def add_far(self, out, t_idx, n_idx, rel):
+        # u + i w = i * conj(S) / (2 pi), S = sum_p a_p / rel**(p+1) (Horner)
+        w = 1 / rel
+        a = self.coeffs[n_idx]
+        S = a[:, -1]
+        for p in range(self.order - 2, -1, -1):
+            S = S * w + a[:, p]
+        S = S * w
+        v = 1j * np.conj(S) / (2*np.pi)
+        self.accumulate(out, t_idx, v)
+
+    def add_direct(self, out, targets, t_idx, n_idx):
+        # Exact profiles of every vortex of the leaves
+        counts = self.end[n_idx] - self.start[n_idx]
+        t = np.repeat(t_idx, counts)
+        j = _ranges(self.start[n_idx], counts)
+        rel = targets[t] - self.zeta[j]
+        r = np.abs(rel)
+        valid = r >= 1e-2
+        r = np.where(valid, r, 1.0)
+        v_t = np.empty_like(r)
+        v_r = np.empty_like(r)
+        for k, p in enumerate(self.profiles):
+            sel = self.profile_id[j] == k if len(self.profiles) > 1 else slice(None)
+            v_t[sel] = p.tangential(r[sel], self.core_radius[j][sel], self.omega0[j][sel])
+            v_r[sel] = p.radial(r[sel], self.core_radius[j][sel], self.strain[j][sel])
+        # (v_r + i v_t) along the outward unit vector rel/r
+        v = np.where(valid, (v_r + 1j*v_t) * rel / r, 0.0)
+        self.accumulate(out, t, v)
+
+    @staticmethod
+    def accumulate(out, t_idx, v):
+        m = len(out)
+        out += np.bincount(t_idx, v.real, minlength=m) + 1j*np.bincount(t_idx, v.imag, minlength=m)
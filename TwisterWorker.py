@@ -0,0 +1,530 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Background physics: the simulation steps in a worker thread or process at
+# its own fixed rate, and the frame only reads the last state it published,
+# so a heavy step (atmosphere, fusion rebuild, mini-map wind) never freezes
+# the window.
+#
+# The worker rebuilds the scenario from its name and seed (the same one as
+# the window, which keeps a copy for the terrain) and publishes after every
+# batch of steps into two shared-memory buffers (multiprocessing.shared_memory),
+# alternately: the tornadoes, their particles and debris, the rain and the
+# wind on the mini-map grid. Each buffer starts with a sequence number, odd
+# while it is being written; the reader copies the latest complete buffer
+# and checks the number did not move (a seqlock), so it never waits for the
+# worker and never draws a half-written state. When the tornadoes change
+# (fusion), the worker sends the new layout (counts, offsets, palettes) on a
+# queue and, if the buffers are too small, moves to larger ones; the old
+# ones are freed once the reader has switched.
+# Inputs go the other way on a queue: player moves, the particle intervals
+# set by the visibility stage (TwisterCulling.py) and the mini-map points.
+#
+# PhysicsWorker stands in for both the Simulation and the FixedStepper of the
+# front-ends (tornadoes, terrain, rain, wind_at, move_player, advance,
+# particle_positions, debris_positions):
+#
+#   sim = stepper = PhysicsWorker('ai', seed, mode='process').start()
+#
+# mode='process' gives the worker its own interpreter (no GIL sharing, the
+# real fix for long steps); it uses the default multiprocessing start method,
+# so on Windows and macOS the launching script must be guarded by
+# if __name__ == '__main__'. mode='thread' needs no guard and still overlaps
+# the NumPy work of the step with the frame.
+
+import atexit
+import queue
+import threading
+import time
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from TwisterDebris import DEBRIS_CLASSES
+from TwisterProfile import NULL_PROFILER
+
+# Columns of the tornado table (read by SceneView, ParticleLOD and MiniMap)
+TORNADO_FIELDS = ('x', 'z', 'base_y', 'height', 'radius_base', 'radius_top', 'max_inclination', 'sin_amplitude',
+                  'v_tot_max')
+
+
+# ----------- Shared Buffers -----------
+def _fields(capacity):
+    # (name, dtype, shape) of one buffer; header = seq, generation, frame,
+    # tornadoes, rain drops, steps; clock = simulation time, step duration (ms)
+    t, p, d = capacity['tornadoes'], capacity['particles'], capacity['debris']
+    return (('header', np.int64, (6,)), ('clock', np.float64, (2,)),
+            ('tornadoes', np.float64, (t, len(TORNADO_FIELDS))),
+            ('pos', np.float32, (p, 3)), ('z', np.float32, (p,)), ('speed', np.float32, (p,)),
+            ('col', np.int16, (p,)), ('debris', np.float32, (d, 3)), ('kind', np.int8, (d,)),
+            ('rain', np.float32, (capacity['rain'], 3)), ('wind', np.float32, (capacity['wind'], 2)))
+
+
+def _size(capacity):
+    size = 0
+    for _, dtype, shape in _fields(capacity):
+        size += -size % 8 + int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return max(size, 8)
+
+
+def _views(buf, capacity):
+    views, offset = {}, 0
+    for name, dtype, shape in _fields(capacity):
+        offset += -offset % 8
+        views[name] = np.ndarray(shape, dtype, buffer=buf, offset=offset)
+        offset += views[name].nbytes
+    return views
+
+
+def _local(capacity):
+    return {name: np.zeros(shape, dtype) for name, dtype, shape in _fields(capacity)}
+
+
+# ----------- Worker Side -----------
+class _Publisher:
+    """
+    Runs inside the worker: owns the simulation and the shared buffers.
+    """
+
+    def __init__(self, sim, control, layouts, wind_rate):
+        self.sim = sim
+        self.control = control
+        self.layouts = layouts
+        self.wind_rate = wind_rate
+        self.generation = 0
+        self.key = None
+        self.capacity = None
+        self.blocks = []
+        self.views = []
+        self.retired = []
+        self.uids = {}
+        self.by_uid = {}
+        self.next_uid = 0
+        self.wind_points = None
+        self.wind_version = 0
+        self.wind = np.zeros((0, 2))
+        self.wind_time = None
+        self.step_ms = 0.0
+        self.steps = 0
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == 'move':
+            self.sim.move_player(message[1], message[2])
+        elif kind == 'intervals':
+            for uid, k in message[1].items():
+                t = self.by_uid.get(uid)
+                if t is not None:
+                    t.particle_interval = k
+        elif kind == 'wind_points':
+            self.wind_version, x, z = message[1:]
+            self.wind_points = (x, z)
+            self.wind_time = None
+        elif kind == 'attached':
+            # The reader left the buffers retired before this generation
+            for generation, blocks in [r for r in self.retired if r[0] <= message[1]]:
+                for shm in blocks:
+                    shm.close()
+                    shm.unlink()
+            self.retired = [r for r in self.retired if r[0] > message[1]]
+
+    def relayout(self, ts):
+        live = {id(t) for t in ts}
+        self.uids = {key: v for key, v in self.uids.items() if key in live}
+        meta, p, d = [], 0, 0
+        for t in ts:
+            if id(t) not in self.uids:
+                self.uids[id(t)] = (t, self.next_uid)
+                self.next_uid += 1
+            meta.append({'uid': self.uids[id(t)][1], 'n_particles': t.n_particles, 'n_debris': t.n_debris,
+                         'particles': p, 'debris': d, 'color_mode': t.color_mode,
+                         'palette': [tuple(c)[:4] for c in t.palette], 'size_range': tuple(t.size_range),
+                         'alpha_range': tuple(t.alpha_range)})
+            p += t.n_particles
+            d += t.n_debris
+        self.by_uid = {uid: t for t, uid in self.uids.values()}
+        need = {'tornadoes': len(ts), 'particles': p, 'debris': d, 'rain': len(self.sim.rain.pos) if self.sim.rain else 0,
+                'wind': len(self.wind)}
+        self.generation += 1
+        if self.capacity is None or any(need[k] > self.capacity[k] for k in need):
+            # Headroom so that a few fusions do not move the buffers again
+            capacity = {k: v + v // 4 + 1 for k, v in need.items()}
+            blocks = [shared_memory.SharedMemory(create=True, size=_size(capacity)) for _ in range(2)]
+            if self.blocks:
+                self.views = []
+                self.retired.append((self.generation, self.blocks))
+            self.blocks, self.capacity = blocks, capacity
+            self.views = [_views(shm.buf, capacity) for shm in blocks]
+        self.layouts.put(('layout', {'generation': self.generation, 'names': [shm.name for shm in self.blocks],
+                                     'capacity': self.capacity, 'tornadoes': meta,
+                                     'wind_version': self.wind_version, 'wind': len(self.wind)}))
+
+    def publish(self):
+        sim = self.sim
+        ts = sim.tornadoes
+        if self.wind_points is not None and (self.wind_time is None or sim.state.time - self.wind_time >= 1 / self.wind_rate):
+            self.wind = sim.wind_at(*self.wind_points)
+            self.wind_time = sim.state.time
+        key = tuple((id(t), t.n_particles, t.n_debris) for t in ts) + (self.wind_version, len(self.wind))
+        if key != self.key:
+            self.relayout(ts)
+            self.key = key
+        b = 1 - int(self.control[0]) if self.control[0] >= 0 else 0
+        v = self.views[b]
+        header = v['header']
+        header[0] += 1
+        p = d = 0
+        for i, t in enumerate(ts):
+            v['tornadoes'][i] = [getattr(t, name) for name in TORNADO_FIELDS]
+            n = t.n_particles
+            s = t.particles
+            v['pos'][p:p+n] = s.pos
+            v['z'][p:p+n] = s.z
+            v['speed'][p:p+n] = s.speed
+            v['col'][p:p+n] = s.col
+            p += n
+            n = t.n_debris
+            v['debris'][d:d+n] = t.debris.pos
+            v['kind'][d:d+n] = t.debris.kind
+            d += n
+        rain = sim.rain.positions() if sim.rain is not None else np.zeros((0, 3))
+        v['rain'][:len(rain)] = rain
+        v['wind'][:len(self.wind)] = self.wind
+        header[1:] = (self.generation, sim.state.frame, len(ts), len(rain), self.steps)
+        v['clock'][:] = (sim.state.time, self.step_ms)
+        header[0] += 1
+        self.control[1] = self.generation
+        self.control[0] = b
+
+    def close(self):
+        self.views = []
+        for shm in self.blocks + [shm for _, blocks in self.retired for shm in blocks]:
+            shm.close()
+            shm.unlink()
+        self.blocks, self.retired = [], []
+
+
+def _serve(scenario, seed, rate, max_substeps, wind_rate, control_name, inputs, layouts, stop, replay_path,
+           wind_grid_size):
+    # Worker loop: steps at rate Hz of wall-clock time (at most max_substeps
+    # per batch, the rest is dropped like FixedStepper), publishes after every batch
+    import TwisterKernels
+    from TwisterEngine import SCENARIOS, record
+    # First steps on the NumPy path rather than waiting for Numba
+    TwisterKernels.load(background=True)
+    control_shm = shared_memory.SharedMemory(name=control_name)
+    control = np.ndarray((2,), np.int64, buffer=control_shm.buf)
+    publisher = None
+    try:
+        sim = record(scenario, seed) if replay_path else SCENARIOS[scenario](seed)
+        if wind_grid_size:
+            from TwisterFluid import WindGrid
+            sim.wind_grid = WindGrid(wind_grid_size, sim.terrain.extent / wind_grid_size)
+        publisher = _Publisher(sim, control, layouts, wind_rate)
+        publisher.publish()
+        dt = 1.0 / rate
+        next_time = time.perf_counter()
+        while not stop.is_set():
+            while True:
+                try:
+                    publisher.handle(inputs.get_nowait())
+                except queue.Empty:
+                    break
+            n = 0
+            while next_time <= time.perf_counter() and n < max_substeps:
+                start = time.perf_counter()
+                sim.step(dt)
+                publisher.step_ms += 0.1 * ((time.perf_counter() - start) * 1e3 - publisher.step_ms)
+                publisher.steps += 1
+                next_time += dt
+                n += 1
+            next_time = max(next_time, time.perf_counter() - dt)
+            if n:
+                publisher.publish()
+            time.sleep(max(next_time - time.perf_counter(), 0.0))
+        if replay_path:
+            sim.replay.save(replay_path)
+    except Exception:
+        layouts.put(('error', traceback.format_exc()))
+    finally:
+        del control
+        control_shm.close()
+        if publisher is not None:
+            publisher.close()
+
+
+# ----------- Render Side -----------
+class _ParticleView:
+    pos = z = speed = col = None
+
+
+class _DebrisView:
+    pos = kind = None
+    _style = None
+
+    def style(self):
+        # Same as TwisterDebris.DebrisField.style, computed once per layout
+        if self._style is None:
+            self._style = (np.array([c[3] for c in DEBRIS_CLASSES])[self.kind],
+                           np.array([c[2] for c in DEBRIS_CLASSES])[self.kind])
+        return self._style
+
+
+class TornadoView:
+    """
+    Read-only copy of a tornado of the worker, with the attributes the
+    renderers use (TORNADO_FIELDS, particles, debris, palette...).
+    particle_interval is sent back to the worker.
+    """
+
+    def __init__(self, meta):
+        self.uid = meta['uid']
+        self.particles = _ParticleView()
+        self.debris = _DebrisView()
+        self.particle_interval = 1
+        self.set_meta(meta)
+
+    def set_meta(self, meta):
+        self.n_particles = meta['n_particles']
+        self.n_debris = meta['n_debris']
+        self.color_mode = meta['color_mode']
+        self.palette = meta['palette']
+        self.size_range = meta['size_range']
+        self.alpha_range = meta['alpha_range']
+        self.debris._style = None
+
+    @property
+    def debris_pos(self):
+        return self.debris.pos
+
+
+class _Clock:
+    frame = 0
+    time = 0.0
+
+
+class _RainView:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.pos = np.zeros((0, 3))
+
+    def positions(self):
+        return self.pos
+
+
+class PhysicsWorker:
+    """
+    scenario, seed : a name of TwisterEngine.SCENARIOS and its seed (None: new)
+    mode           : 'thread' or 'process'
+    rate           : physics steps per second
+    max_substeps   : steps per batch at most (the rest is dropped)
+    wind_rate      : refreshes per second of the wind at the wind_at points
+    replay_path    : the worker records a ReplayLog and saves it there on stop
+    wind_grid_size : nodes per side of a TwisterFluid.WindGrid (0: analytic wind)
+    """
+
+    def __init__(self, scenario, seed=None, mode='thread', rate=60.0, max_substeps=5, wind_rate=10.0,
+                 replay_path=None, wind_grid_size=0):
+        from TwisterEngine import SCENARIOS
+        if mode not in ('thread', 'process'):
+            raise ValueError('unknown worker mode %r' % mode)
+        # Local copy of the scenario for the static data (terrain, seed)
+        local = SCENARIOS[scenario](seed)
+        self.scenario = scenario
+        self.seed = local.seed
+        self.terrain = local.terrain
+        self.rain = _RainView(local.rain.capacity) if local.rain is not None else None
+        self.mode = mode
+        self.rate = rate
+        self.max_substeps = max_substeps
+        self.wind_rate = wind_rate
+        self.replay_path = replay_path
+        self.wind_grid_size = wind_grid_size
+        self.profiler = NULL_PROFILER
+        self.state = _Clock()
+        self.tornadoes = []
+        self.alpha = 1.0
+        self.step_ms = 0.0
+        self.steps = 0
+        self.generation = 0
+        self.layout = None
+        self.blocks = []
+        self.views = []
+        self.local = None
+        self.proxies = {}
+        self.intervals = {}
+        self.wind_points = None
+        self.wind_version = 0
+        self.worker = None
+
+    def start(self, timeout=30.0):
+        """
+        Starts the worker and waits for its first state; returns self.
+        """
+        if self.mode == 'process':
+            ctx = multiprocessing.get_context()
+            self.inputs, self.layouts, self.stop_event = ctx.Queue(), ctx.Queue(), ctx.Event()
+            spawn = ctx.Process
+        else:
+            self.inputs, self.layouts, self.stop_event = queue.Queue(), queue.Queue(), threading.Event()
+            spawn = threading.Thread
+        self.control_shm = shared_memory.SharedMemory(create=True, size=16)
+        self.control = np.ndarray((2,), np.int64, buffer=self.control_shm.buf)
+        self.control[:] = (-1, 0)
+        self.worker = spawn(target=_serve, daemon=True,
+                            args=(self.scenario, self.seed, self.rate, self.max_substeps, self.wind_rate,
+                                  self.control_shm.name, self.inputs, self.layouts, self.stop_event,
+                                  self.replay_path, self.wind_grid_size))
+        self.worker.start()
+        atexit.register(self.stop)
+        deadline = time.perf_counter() + timeout
+        while not self.read() and not self.tornadoes:
+            if time.perf_counter() > deadline:
+                raise RuntimeError('the physics worker did not start')
+            time.sleep(0.005)
+        return self
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self.stop_event.set()
+        self.worker.join(timeout=5.0)
+        self.worker = None
+        self.detach()
+        del self.control
+        self.control_shm.close()
+        self.control_shm.unlink()
+
+    def detach(self):
+        self.views = []
+        for shm in self.blocks:
+            shm.close()
+        self.blocks = []
+
+    # ----------- Reading -----------
+    def check(self, wait):
+        # Next message of the worker: a layout, or the error that stopped it
+        try:
+            kind, payload = self.layouts.get(timeout=1.0) if wait else self.layouts.get_nowait()
+        except queue.Empty:
+            if self.worker is not None and not self.worker.is_alive():
+                raise RuntimeError('the physics worker stopped')
+            return None
+        if kind == 'error':
+            raise RuntimeError('physics worker failed:\n' + payload)
+        return payload
+
+    def apply_layout(self, generation):
+        while self.generation < generation:
+            layout = self.check(wait=True)
+            if layout is None:
+                continue
+            if self.layout is None or layout['names'] != self.layout['names']:
+                self.detach()
+                self.blocks = [shared_memory.SharedMemory(name=name) for name in layout['names']]
+                self.views = [_views(shm.buf, layout['capacity']) for shm in self.blocks]
+                self.inputs.put(('attached', layout['generation']))
+            if self.layout is None or layout['capacity'] != self.layout['capacity']:
+                self.local = _local(layout['capacity'])
+            self.layout = layout
+            self.generation = layout['generation']
+        # Same TornadoView objects for the same tornadoes (the renderers key on them)
+        proxies = {}
+        for meta in self.layout['tornadoes']:
+            t = self.proxies.get(meta['uid'])
+            if t is None:
+                t = TornadoView(meta)
+            else:
+                t.set_meta(meta)
+            p, n = meta['particles'], meta['n_particles']
+            t.particles.pos = self.local['pos'][p:p+n]
+            t.particles.z = self.local['z'][p:p+n]
+            t.particles.speed = self.local['speed'][p:p+n]
+            t.particles.col = self.local['col'][p:p+n]
+            d, n = meta['debris'], meta['n_debris']
+            t.debris.pos = self.local['debris'][d:d+n]
+            t.debris.kind = self.local['kind'][d:d+n]
+            proxies[t.uid] = t
+        self.proxies = proxies
+        self.tornadoes[:] = list(proxies.values())
+
+    def advance(self, frame_dt):
+        """
+        Copies the latest complete state of the worker; returns the number of
+        physics steps it made since the previous call.
+        """
+        with self.profiler.stage('physics read'):
+            steps = self.read()
+        self.profiler.count(physics_ms=self.step_ms)
+        return steps
+
+    def read(self):
+        intervals = {t.uid: t.particle_interval for t in self.tornadoes}
+        if intervals != self.intervals:
+            self.inputs.put(('intervals', intervals))
+            self.intervals = intervals
+        generation = int(self.control[1])
+        if generation == 0:
+            self.check(wait=False)
+            return 0
+        if generation != self.generation:
+            self.apply_layout(generation)
+        for _ in range(3):
+            b = int(self.control[0])
+            v = self.views[b]
+            seq = int(v['header'][0])
+            if seq % 2 or v['header'][1] != self.generation:
+                continue
+            header = v['header'].copy()
+            n_t, n_rain = int(header[3]), int(header[4])
+            meta = self.layout['tornadoes']
+            n_p = sum(m['n_particles'] for m in meta)
+            n_d = sum(m['n_debris'] for m in meta)
+            local = self.local
+            table = v['tornadoes'][:n_t].copy()
+            for name, n in (('pos', n_p), ('z', n_p), ('speed', n_p), ('col', n_p), ('debris', n_d), ('kind', n_d)):
+                np.copyto(local[name][:n], v[name][:n])
+            rain = v['rain'][:n_rain].copy()
+            wind = v['wind'][:self.layout['wind']].copy()
+            clock = v['clock'].copy()
+            if int(v['header'][0]) == seq:
+                break
+        else:
+            return 0
+        for t, row in zip(self.tornadoes, table):
+            for name, value in zip(TORNADO_FIELDS, row.tolist()):
+                setattr(t, name, value)
+        if self.rain is not None:
+            self.rain.pos = rain
+        self.wind = wind
+        new_steps = int(header[5]) - self.steps
+        self.steps = int(header[5])
+        self.state.frame = int(header[2])
+        self.state.time, self.step_ms = clock.tolist()
+        return new_steps
+
+    def particle_positions(self, t, index=None):
+        return t.particles.pos if index is None else t.particles.pos[index]
+
+    def debris_positions(self, t):
+        return t.debris.pos
+
+    # ----------- Simulation Interface -----------
+    def move_player(self, dx, dz):
+        self.inputs.put(('move', dx, dz))
+
+    def wind_at(self, x, z):
+        """
+        Wind at the points (x, z), computed by the worker at wind_rate: the
+        first call registers the points, zero wind until they are published.
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        z = np.asarray(z, dtype=float).ravel()
+        if self.wind_points is None or not (np.array_equal(x, self.wind_points[0])
+                                            and np.array_equal(z, self.wind_points[1])):
+            self.wind_points = (x.copy(), z.copy())
+            self.wind_version += 1
+            self.inputs.put(('wind_points', self.wind_version, x.copy(), z.copy()))
+        if self.layout is not None and self.layout['wind_version'] == self.wind_version:
+            return self.wind.astype(float)
+        return np.zeros((len(x), 2))
@@ -0,0 +1,8 @@
+# Author(s): Dr. Patrick Lemoine
+
+# The Twister* modules live at the repository root, next to the scripts.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
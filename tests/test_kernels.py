@@ -0,0 +1,87 @@
+# Author(s): Dr. Patrick Lemoine
+
+# The Numba kernels of TwisterKernels against the NumPy path of
+# ParticleStore.advect.
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+numba = pytest.importorskip('numba')
+
+import TwisterKernels
+from TwisterParticles import ParticleStore
+from TwisterVortex import get_profile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeVortex:
+    height, radius_base, radius_top, core_radius = 20.0, 0.25, 3.0, 1.6
+    omega0, max_inclination, sin_amplitude, sin_freq = 7.0, 10.0, 0.5, 2.5
+
+    def __init__(self, profile):
+        self.profile = profile
+
+
+def run(backend, vortex, n=1000, steps=300):
+    TwisterKernels.set_backend(backend)
+    store = ParticleStore.funnel(n, vortex.height, vortex.radius_base, vortex.radius_top,
+                                 rng=np.random.default_rng(3))
+    for k in range(steps):
+        store.advect(1/60, k/60, vortex, (5.0, 0.2, 7.0))
+    return store
+
+
+@pytest.fixture
+def restore_backend():
+    previous = TwisterKernels.backend()
+    yield
+    TwisterKernels.set_backend(previous)
+
+
+@pytest.mark.parametrize('profile', ['rankine', 'lamb_oseen'])
+def test_numba_matches_numpy(profile, restore_backend):
+    # The tabulated Lamb-Oseen profile goes through the lookup table branch
+    vortex = FakeVortex(get_profile(profile, tabulated=profile != 'rankine'))
+    expected = run('numpy', vortex)
+    actual = run('numba', vortex)
+    for name in ('r', 'theta', 'z', 'pos', 'speed'):
+        np.testing.assert_allclose(getattr(actual, name), getattr(expected, name), rtol=0, atol=1e-9, err_msg=name)
+
+
+def test_parallel_kernel_runs_threaded(tmp_path):
+    # Fresh process: the thread count is read when Numba is imported, and an
+    # empty cache catches a parallel kernel loaded from the serial cache entry
+    script = textwrap.dedent('''
+        import numpy as np
+        import TwisterKernels
+        from TwisterParticles import ParticleStore
+
+        class Vortex:
+            height, radius_base, radius_top, core_radius = 20.0, 0.25, 3.0, 1.6
+            omega0, max_inclination, sin_amplitude, sin_freq = 7.0, 10.0, 0.5, 2.5
+
+        TwisterKernels.load()
+        assert TwisterKernels._advect_parallel is not TwisterKernels._advect_serial
+        n = TwisterKernels.PARALLEL_THRESHOLD
+        stores = {}
+        for name in ('numpy', 'numba'):
+            TwisterKernels.set_backend(name)
+            stores[name] = ParticleStore.funnel(n, 20.0, 0.25, 3.0, rng=np.random.default_rng(0))
+            for k in range(10):
+                stores[name].advect(1/60, k/60, Vortex, (0.0, 0.0, 0.0))
+        print(TwisterKernels.threading_layer())
+        print(np.abs(stores['numpy'].pos - stores['numba'].pos).max())
+    ''')
+    env = dict(os.environ, NUMBA_NUM_THREADS='2', NUMBA_CACHE_DIR=str(tmp_path), TWISTER_BACKEND='numba')
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, timeout=300)
+    assert out.returncode == 0, out.stderr
+    layer, error = out.stdout.split()
+    assert layer != 'None'
+    assert float(error) < 1e-9
@@ -0,0 +1,78 @@
+# Author(s): Dr. Patrick Lemoine
+
+# ParticleStore.advect against the per-particle loop of the original
+# update() (OneTwister.py before the particle store), given the same clock
+# and the same respawn angles.
+
+import numpy as np
+import pytest
+
+import TwisterKernels
+from TwisterParticles import ParticleStore
+
+
+class FakeVortex:
+    height, radius_base, radius_top, core_radius = 20.0, 0.25, 3.0, 1.6
+    omega0, max_inclination, sin_amplitude, sin_freq = 7.0, 10.0, 0.5, 2.5
+
+
+def get_vortex_velocity(r, core_radius, omega0):
+    if r < core_radius:
+        v_theta = omega0 * r
+    else:
+        v_theta = omega0 * core_radius**2 / r
+    return v_theta
+
+
+def scalar_update(particles, dt, clock, v, origin, rng):
+    # The loop of update(), with time.time() replaced by clock and
+    # np.random by rng
+    for part in particles:
+        r = part['r']
+        v_theta = get_vortex_velocity(r, v.core_radius, v.omega0)
+        v_up = 2.0 + (0.5 - 2.0) * (r / v.radius_top)
+        part['theta'] += dt * v_theta / (r + 1e-3)
+        part['z'] += dt * v_up
+        if part['z'] > v.height:
+            part['z'] = 0
+            part['r'] = v.radius_base + (v.radius_top - v.radius_base) * (part['z'] / v.height)**1.5
+            part['theta'] = rng.uniform(0, 2 * np.pi)
+        frac = part['z'] / v.height
+        x_axis = v.max_inclination * frac
+        z_axis = 0
+        x_axis += v.sin_amplitude * np.sin(v.sin_freq * frac * np.pi + clock)
+        z_axis += v.sin_amplitude * np.cos(v.sin_freq * frac * np.pi + clock * 0.8)
+        part['r'] = v.radius_base + (v.radius_top - v.radius_base) * (part['z'] / v.height)**1.5
+        part['pos'] = (origin[0] + x_axis + part['r'] * np.cos(part['theta']),
+                       origin[1] + part['z'],
+                       origin[2] + z_axis + part['r'] * np.sin(part['theta']))
+        part['speed'] = np.sqrt(v_theta**2 + v_up**2)
+
+
+@pytest.fixture
+def numpy_backend():
+    previous = TwisterKernels.backend()
+    TwisterKernels.set_backend('numpy')
+    yield
+    TwisterKernels.set_backend(previous)
+
+
+def test_advect_matches_scalar_loop(numpy_backend):
+    v = FakeVortex()
+    store = ParticleStore.funnel(400, v.height, v.radius_base, v.radius_top, r_jitter=1.0,
+                                 rng=np.random.default_rng(7))
+    particles = [{'r': r, 'theta': th, 'z': z} for r, th, z in zip(store.r, store.theta, store.z)]
+    rng = np.random.default_rng(11)
+    store.rng = np.random.default_rng(11)
+    origin = (12.0, 0.4, 30.0)
+    respawned = 0
+    for k in range(300):
+        clock = 100.0 + k / 60
+        before = store.z.copy()
+        store.advect(1/60, clock, v, origin)
+        respawned += np.count_nonzero(store.z < before)
+        scalar_update(particles, 1/60, clock, v, origin, rng)
+    assert respawned > 0
+    np.testing.assert_allclose(store.pos, [p['pos'] for p in particles], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(store.theta, [p['theta'] for p in particles], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(store.speed, [p['speed'] for p in particles], rtol=0, atol=1e-9)
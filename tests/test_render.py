@@ -0,0 +1,45 @@
+# Author(s): Dr. Patrick Lemoine
+
+# PointCloud of TwisterRender drawn by an offscreen Panda3D buffer.
+
+import numpy as np
+import pytest
+
+pytest.importorskip('panda3d')
+from panda3d.core import GeomVertexReader, loadPrcFileData
+
+
+@pytest.fixture(scope='module')
+def base():
+    loadPrcFileData('', 'load-display p3tinydisplay\nwindow-type offscreen\naudio-library-name null')
+    from direct.showbase.ShowBase import ShowBase
+    try:
+        base = ShowBase(windowType='offscreen')
+    except Exception as exc:
+        pytest.skip('no offscreen buffer: %s' % exc)
+    yield base
+    base.destroy()
+
+
+def vertices(cloud):
+    geom = cloud.node_path.node().get_geom(0)
+    reader = GeomVertexReader(geom.get_vertex_data(), 'vertex')
+    points = []
+    for _ in range(geom.get_primitive(0).get_num_vertices()):
+        points.append(tuple(reader.get_data3()))
+    return np.array(points)
+
+
+def test_point_cloud_update_and_resize(base):
+    from TwisterRender import PointCloud
+    rng = np.random.default_rng(0)
+    cloud = PointCloud(64, parent=base.render, use_shader=False)
+    for n in (50, 300, 20):  # fits, grows past the capacity, shrinks
+        positions = rng.uniform(-10, 10, (n, 3))
+        cloud.update(positions, colors=(1.0, 0.0, 0.0, 1.0), sizes=0.1)
+        base.graphicsEngine.render_frame()
+        assert cloud.count == n
+        assert cloud.points.get_num_vertices() == n
+        np.testing.assert_allclose(vertices(cloud), positions, atol=1e-5)
+    assert len(cloud.buffer) >= 300
+    cloud.destroy()